@@ -3,9 +3,10 @@ import os
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
 from flask_socketio import SocketIO, emit
-from telegram_client_simple import SimpleTelegramClient
+from telegram_client_simple import SimpleTelegramClient, RATE_SETTINGS
 from async_helper import AsyncHelper
 from database import DatabaseManager
+from message_filters import FilterError, compile_filters
 import logging
 from async_helper import async_helper
 from dotenv import load_dotenv
@@ -69,18 +70,12 @@ def initialize_client_on_startup():
                 enabled_rules = db_manager.get_enabled_rules()
                 if enabled_rules:
                     app.logger.info(f"Loading {len(enabled_rules)} enabled rules on startup")
-                    # Clear existing rules first to avoid duplicates
-                    telegram_client.forwarding_rules = []
-                    
-                    # Add all enabled rules to client with proper IDs
-                    for rule in enabled_rules:
-                        result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(
-                            rule['source'], rule['target'], rule['filters'], rule['id']
-                        ))
-                        if result and result.get('success'):
-                            app.logger.info(f"Loaded rule: {rule['source']} -> {rule['target']} (ID: {rule['id']})")
-                        else:
-                            app.logger.error(f"Failed to load rule: {rule['source']} -> {rule['target']}")
+                    # Load all enabled rules into the client in one snapshot
+                    result = async_helper.run_async_safe(telegram_client.sync_rules(enabled_rules))
+                    if result and result.get('success'):
+                        app.logger.info(f"Loaded {result.get('updated', 0)} rules (version {result.get('version')})")
+                    else:
+                        app.logger.error(f"Failed to load rules: {result.get('message') if result else 'No result'}")
                     
                     # Start forwarding if we have enabled rules
                     async_helper.run_async_safe(telegram_client.start_forwarding())
@@ -252,17 +247,11 @@ def dashboard():
 def sync_rules_with_database():
     """Synchronize Telegram client rules with database state"""
     try:
-        # Clear client rules
-        telegram_client.forwarding_rules = []
-        
         # Load enabled rules from database
         enabled_rules = db_manager.get_enabled_rules()
         
-        # Add enabled rules to client
-        for rule in enabled_rules:
-            async_helper.run_async_safe(telegram_client.add_forwarding_rule(
-                rule['source'], rule['target'], rule['filters'], rule['id']
-            ))
+        # Apply only the differences to the client
+        async_helper.run_async_safe(telegram_client.sync_rules(enabled_rules))
         
         # Start or stop forwarding based on rules
         if enabled_rules and not telegram_client.is_running:
@@ -484,9 +473,6 @@ def start_forwarding():
         if telegram_client.is_running:
             return jsonify({'success': False, 'message': 'Already running'})
         
-        # Clear existing rules first
-        telegram_client.forwarding_rules = []
-        
         # First, enable ALL rules in database
         all_rules = db_manager.get_all_rules()
         enabled_rules = []
@@ -498,9 +484,8 @@ def start_forwarding():
             else:
                 enabled_rules.append(rule)
         
-        # Then add all enabled rules to running client
-        for rule in enabled_rules:
-            result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters']))
+        # Then load all enabled rules into the running client
+        async_helper.run_async_safe(telegram_client.sync_rules(enabled_rules))
         
         # Update database status
         db_manager.set_forwarding_status(True)
@@ -528,7 +513,7 @@ def stop_forwarding():
             
             if result.get('success'):
                 # Clear client rules first
-                telegram_client.forwarding_rules = []
+                async_helper.run_async_safe(telegram_client.sync_rules([]))
                 
                 # Deactivate ALL rules in database when stopping
                 all_rules = db_manager.get_all_rules()
@@ -566,16 +551,28 @@ def add_rule():
     data = request.json
     
     try:
+        # Reject filters that can't be compiled before storing the rule
+        try:
+            compile_filters(data.get('filters', {}))
+        except FilterError as e:
+            return jsonify({'success': False, 'message': f'Invalid filters: {e}'})
+        
+        try:
+            priority = int(data.get('priority') or 0)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Priority must be an integer'})
+        
         rule = db_manager.add_rule(
             data['source'],
             data['target'],
-            data.get('filters', {})
+            data.get('filters', {}),
+            priority
         )
         
         # Add to running client if active and rule is enabled
         if telegram_client and telegram_client.is_authenticated and rule['enabled']:
             # Use async helper to run the operation
-            result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters']))
+            result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters'], rule['id'], rule['priority']))
         
         # Log activity
         db_manager.log_activity(
@@ -601,7 +598,7 @@ def toggle_rule(rule_id):
         if telegram_client and telegram_client.is_authenticated:
             if rule['enabled']:
                 # Add rule to client with database ID
-                result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters'], rule['id']))
+                result = async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters'], rule['id'], rule['priority']))
                 # Start forwarding if not already running
                 if not telegram_client.is_running:
                     async_helper.run_async_safe(telegram_client.start_forwarding())
@@ -633,6 +630,35 @@ def toggle_rule(rule_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/rules/<int:rule_id>/priority', methods=['PUT', 'POST'])
+def set_rule_priority(rule_id):
+    data = request.json or {}
+    
+    try:
+        try:
+            priority = int(data.get('priority'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Priority must be an integer'})
+        
+        rule = db_manager.set_rule_priority(rule_id, priority)
+        if not rule:
+            return jsonify({'success': False, 'message': 'Rule not found'})
+        
+        # Update running client if the rule is active
+        if telegram_client and telegram_client.is_authenticated and rule['enabled']:
+            async_helper.run_async_safe(telegram_client.add_forwarding_rule(rule['source'], rule['target'], rule['filters'], rule['id'], rule['priority']))
+        
+        db_manager.log_activity(
+            activity_type='rule_updated',
+            description=f"Set priority {priority} for forwarding rule: {rule['source']} → {rule['target']}",
+            rule_id=rule_id
+        )
+        
+        return jsonify({'success': True, 'rule': rule})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Get current settings"""
@@ -656,8 +682,21 @@ def update_settings():
     app.logger.info(f"Updating settings with data: {data}")
     
     try:
+        # Rate limits must be positive numbers
+        for key, (_, cast) in RATE_SETTINGS.items():
+            if key in data:
+                try:
+                    if cast(data[key]) <= 0:
+                        raise ValueError
+                except (TypeError, ValueError):
+                    return jsonify({'success': False, 'message': f'{key} must be a positive number'})
+        
         db_manager.update_settings(data)
         app.logger.info("Settings updated successfully in database")
+        
+        # Apply new rate limits to the running client
+        if telegram_client:
+            async_helper.run_async_safe(telegram_client.update_rate_settings(data))
         return jsonify({'success': True, 'message': 'Settings updated'})
     
     except Exception as e:
@@ -678,6 +717,58 @@ def get_activity():
         app.logger.error(f"Error getting activity: {e}")
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/dead-letters', methods=['GET'])
+def get_dead_letters():
+    """List dead letters (sends that failed for good) with counts per status"""
+    if 'authenticated' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+
+    try:
+        status = request.args.get('status', 'pending')
+        limit = request.args.get('limit', 100, type=int)
+        return jsonify({
+            'success': True,
+            'dead_letters': db_manager.get_dead_letters(status=status, limit=limit),
+            'counts': db_manager.count_dead_letters()
+        })
+    except Exception as e:
+        app.logger.error(f"Error getting dead letters: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/dead-letters/redrive', methods=['POST'])
+def redrive_dead_letters():
+    """Queue pending dead letters again (all, or the given ids) at a limited rate"""
+    if 'authenticated' not in session:
+        return jsonify({'success': False, 'message': 'Not authenticated'})
+
+    data = request.json or {}
+    try:
+        ids = data.get('ids')
+        if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+            return jsonify({'success': False, 'message': 'ids must be a list of dead letter ids'})
+        try:
+            limit = int(data.get('limit', 100))
+            rate = float(data['rate']) if data.get('rate') is not None else None
+            if limit <= 0 or (rate is not None and rate <= 0):
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'limit and rate must be positive numbers'})
+
+        if not telegram_client or not telegram_client.is_authenticated:
+            return jsonify({'success': False, 'message': 'Client not authenticated'})
+
+        result = async_helper.run_async_safe(telegram_client.redrive_dead_letters(ids, limit, rate))
+        if result and result.get('success') and result.get('queued'):
+            db_manager.log_activity(
+                activity_type='dead_letters_redriven',
+                description=f"Re-driving {result['queued']} dead letters at {result['rate_per_minute']:g} per minute",
+                details={'ids': ids} if ids else None
+            )
+        return jsonify(result or {'success': False, 'message': 'No result'})
+    except Exception as e:
+        app.logger.error(f"Error re-driving dead letters: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/api/stats', methods=['GET'])
 def get_dashboard_stats_api():
     """Get dashboard statistics"""
@@ -717,6 +808,7 @@ def get_dashboard_stats_api():
             'is_forwarding': telegram_client.is_running if telegram_client else False,
             'daily_forwards': telegram_stats.get('daily_forwards', 0),
             'max_daily_forwards': telegram_stats.get('max_daily_forwards', 100),
+            'rate_limits': telegram_stats.get('rate_limits'),
             'loaded_rules_count': len(telegram_client.forwarding_rules) if telegram_client else 0,
             'loaded_rules_debug': loaded_rules_debug
         }
@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small LRU cache with per-entry expiry and hit/miss counters"""
+
+    def __init__(self, max_size=1000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value, or default if missing or expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove an entry and return its value"""
+        entry = self._data.pop(key, None)
+        return entry[0] if entry else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        """Get cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
@@ -51,7 +51,8 @@ class DatabaseManager:
                         enabled BOOLEAN DEFAULT 1,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        message_count INTEGER DEFAULT 0
+                        message_count INTEGER DEFAULT 0,
+                        priority INTEGER DEFAULT 0
                     )
                 ''')
                 
@@ -102,6 +103,67 @@ class DatabaseManager:
                     )
                 ''')
                 
+                # Create entity_cache table for resolved usernames
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS entity_cache (
+                        username TEXT PRIMARY KEY,
+                        peer_id INTEGER NOT NULL,
+                        resolved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                # Create ingest_queue table: durable journal of received messages
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS ingest_queue (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        chat_id INTEGER NOT NULL,
+                        message_id INTEGER NOT NULL,
+                        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE (chat_id, message_id)
+                    )
+                ''')
+                
+                # Create delivery_ledger table: which rule already delivered which source message
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS delivery_ledger (
+                        source_chat INTEGER NOT NULL,
+                        message_id INTEGER NOT NULL,
+                        rule_id INTEGER NOT NULL,
+                        target_message_id INTEGER,
+                        delivered_at INTEGER NOT NULL,
+                        PRIMARY KEY (source_chat, message_id, rule_id)
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_delivery_ledger_delivered_at ON delivery_ledger (delivered_at)')
+                
+                # Create dead_letters table: sends that failed for good, kept for a re-drive
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS dead_letters (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        source_chat INTEGER NOT NULL,
+                        message_id INTEGER NOT NULL,
+                        message_ids TEXT NOT NULL,
+                        rule_id INTEGER NOT NULL,
+                        target TEXT,
+                        error_class TEXT NOT NULL,
+                        error TEXT,
+                        attempts INTEGER DEFAULT 0,
+                        status TEXT DEFAULT 'pending',
+                        failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        redriven_at TIMESTAMP
+                    )
+                ''')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_dead_letters_status ON dead_letters (status, id)')
+                
+                # Create source_checkpoints table: last message id seen per source chat
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS source_checkpoints (
+                        chat_id INTEGER PRIMARY KEY,
+                        last_message_id INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
                 # Add display_name column if it doesn't exist (for existing databases)
                 try:
                     cursor.execute('ALTER TABLE users ADD COLUMN display_name TEXT')
@@ -120,6 +182,12 @@ class DatabaseManager:
                 except:
                     pass  # Column already exists
                 
+                # Add priority column if it doesn't exist (for existing databases)
+                try:
+                    cursor.execute('ALTER TABLE forwarding_rules ADD COLUMN priority INTEGER DEFAULT 0')
+                except:
+                    pass  # Column already exists
+                
                 conn.commit()
                 self.logger.info("Database tables created successfully")
                 
@@ -130,7 +198,7 @@ class DatabaseManager:
             self.logger.error(f"Error creating tables: {e}")
             raise
     
-    def add_rule(self, source, target, filters=None):
+    def add_rule(self, source, target, filters=None, priority=0):
         """Add a new forwarding rule"""
         if filters is None:
             filters = {}
@@ -142,9 +210,9 @@ class DatabaseManager:
                 filters_json = json.dumps(filters or {})
                 
                 cursor.execute('''
-                    INSERT INTO forwarding_rules (source, target, filters, enabled)
-                    VALUES (?, ?, ?, 1)
-                ''', (source, target, filters_json))
+                    INSERT INTO forwarding_rules (source, target, filters, enabled, priority)
+                    VALUES (?, ?, ?, 1, ?)
+                ''', (source, target, filters_json, int(priority or 0)))
                 
                 rule_id = cursor.lastrowid
                 conn.commit()
@@ -163,7 +231,7 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                    SELECT id, source, target, filters, enabled, created_at, message_count
+                    SELECT id, source, target, filters, enabled, created_at, message_count, priority
                     FROM forwarding_rules WHERE id = ?
                 ''', (rule_id,))
                 
@@ -176,7 +244,8 @@ class DatabaseManager:
                         'filters': json.loads(row[3]),
                         'enabled': bool(row[4]),
                         'created_at': row[5],
-                        'message_count': row[6]
+                        'message_count': row[6],
+                        'priority': row[7] or 0
                     }
                 return None
                 
@@ -191,7 +260,7 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                    SELECT id, source, target, filters, enabled, created_at, message_count
+                    SELECT id, source, target, filters, enabled, created_at, message_count, priority
                     FROM forwarding_rules ORDER BY created_at DESC
                 ''')
                 
@@ -204,7 +273,8 @@ class DatabaseManager:
                         'filters': json.loads(row[3]) if row[3] else {},
                         'enabled': bool(row[4]),
                         'created_at': row[5],
-                        'message_count': row[6] if row[6] else 0
+                        'message_count': row[6] if row[6] else 0,
+                        'priority': row[7] or 0
                     })
                 
                 return rules
@@ -220,7 +290,7 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                    SELECT id, source, target, filters, enabled, created_at, message_count
+                    SELECT id, source, target, filters, enabled, created_at, message_count, priority
                     FROM forwarding_rules WHERE enabled = 1 ORDER BY created_at DESC
                 ''')
                 
@@ -233,7 +303,8 @@ class DatabaseManager:
                         'filters': json.loads(row[3]),
                         'enabled': bool(row[4]),
                         'created_at': row[5],
-                        'message_count': row[6]
+                        'message_count': row[6],
+                        'priority': row[7] or 0
                     })
                 
                 return rules
@@ -272,6 +343,28 @@ class DatabaseManager:
             self.logger.error(f"Error toggling rule: {e}")
             raise
     
+    def set_rule_priority(self, rule_id, priority):
+        """Set a rule's dispatch priority (higher is served first)"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    UPDATE forwarding_rules 
+                    SET priority = ?, updated_at = CURRENT_TIMESTAMP 
+                    WHERE id = ?
+                ''', (int(priority), rule_id))
+                
+                conn.commit()
+                
+                if cursor.rowcount == 0:
+                    return None
+                return self.get_rule(rule_id)
+                
+        except Exception as e:
+            self.logger.error(f"Error setting rule priority: {e}")
+            raise
+    
     def delete_rule(self, rule_id):
         """Delete a forwarding rule"""
         try:
@@ -287,6 +380,308 @@ class DatabaseManager:
             self.logger.error(f"Error deleting rule: {e}")
             raise
     
+    def get_cached_entities(self, max_age_seconds):
+        """Get cached username -> peer ID resolutions younger than max_age_seconds"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT username, peer_id,
+                           CAST(strftime('%s', 'now') - strftime('%s', resolved_at) AS INTEGER)
+                    FROM entity_cache
+                    WHERE resolved_at >= datetime('now', ?)
+                ''', (f'-{int(max_age_seconds)} seconds',))
+                
+                return [
+                    {'username': row[0], 'peer_id': row[1], 'age': row[2] or 0}
+                    for row in cursor.fetchall()
+                ]
+                
+        except Exception as e:
+            self.logger.error(f"Error getting cached entities: {e}")
+            return []
+    
+    def save_cached_entity(self, username, peer_id):
+        """Store a username -> peer ID resolution"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    INSERT OR REPLACE INTO entity_cache (username, peer_id, resolved_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', (username, peer_id))
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error saving cached entity: {e}")
+    
+    def delete_cached_entity(self, username):
+        """Remove a cached username resolution"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('DELETE FROM entity_cache WHERE username = ?', (username,))
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error deleting cached entity: {e}")
+    
+    def append_ingest_entries(self, entries):
+        """Append (chat_id, message_id) pairs to the ingest journal in one transaction"""
+        if not entries:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO ingest_queue (chat_id, message_id)
+                    VALUES (?, ?)
+                ''', entries)
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error appending ingest entries: {e}")
+            raise
+    
+    def ack_ingest_entries(self, entries):
+        """Remove processed (chat_id, message_id) pairs from the ingest journal"""
+        if not entries:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    DELETE FROM ingest_queue WHERE chat_id = ? AND message_id = ?
+                ''', entries)
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error acknowledging ingest entries: {e}")
+            raise
+    
+    def get_pending_ingest_entries(self, after_id=0, limit=200):
+        """Get the oldest unacknowledged ingest entries with id greater than after_id"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                    SELECT id, chat_id, message_id, received_at
+                    FROM ingest_queue WHERE id > ? ORDER BY id LIMIT ?
+                ''', (after_id, limit))
+                
+                return [
+                    {'id': row[0], 'chat_id': row[1], 'message_id': row[2], 'received_at': row[3]}
+                    for row in cursor.fetchall()
+                ]
+                
+        except Exception as e:
+            self.logger.error(f"Error getting pending ingest entries: {e}")
+            return []
+    
+    def count_pending_ingest_entries(self):
+        """Count unacknowledged ingest entries"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM ingest_queue')
+                return cursor.fetchone()[0]
+                
+        except Exception as e:
+            self.logger.error(f"Error counting ingest entries: {e}")
+            return 0
+    
+    def record_deliveries(self, entries):
+        """Record (source_chat, message_id, rule_id, target_message_id, delivered_at) rows in one transaction"""
+        if not entries:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO delivery_ledger
+                        (source_chat, message_id, rule_id, target_message_id, delivered_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', entries)
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error recording deliveries: {e}")
+            raise
+    
+    def get_delivered_rules(self, source_chat, message_id):
+        """Get the ids of the rules that already delivered a source message"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT rule_id FROM delivery_ledger WHERE source_chat = ? AND message_id = ?
+                ''', (source_chat, message_id))
+                return {row[0] for row in cursor.fetchall()}
+                
+        except Exception as e:
+            self.logger.error(f"Error reading delivery ledger: {e}")
+            return set()
+    
+    def prune_delivery_ledger(self, max_age_seconds):
+        """Delete ledger rows older than max_age_seconds; returns how many were deleted"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'DELETE FROM delivery_ledger WHERE delivered_at < ?',
+                    (int(datetime.now().timestamp()) - int(max_age_seconds),)
+                )
+                conn.commit()
+                return cursor.rowcount
+                
+        except Exception as e:
+            self.logger.error(f"Error pruning delivery ledger: {e}")
+            return 0
+    
+    def add_dead_letters(self, entries):
+        """Record failed sends in one transaction.
+
+        Each entry is (source_chat, message_id, message_ids, rule_id, target,
+        error_class, error, attempts); message_ids lists the album parts.
+        """
+        if not entries:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    INSERT INTO dead_letters
+                        (source_chat, message_id, message_ids, rule_id, target, error_class, error, attempts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (source_chat, message_id, json.dumps(message_ids), rule_id, target, error_class, error, attempts)
+                    for source_chat, message_id, message_ids, rule_id, target, error_class, error, attempts in entries
+                ])
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error adding dead letters: {e}")
+            raise
+    
+    def get_dead_letters(self, status='pending', limit=100, ids=None):
+        """Get the oldest dead letters with a status, optionally only the given ids"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                query = '''
+                    SELECT id, source_chat, message_id, message_ids, rule_id, target,
+                           error_class, error, attempts, status, failed_at, redriven_at
+                    FROM dead_letters WHERE status = ?
+                '''
+                params = [status]
+                if ids:
+                    query += f" AND id IN ({','.join('?' * len(ids))})"
+                    params.extend(ids)
+                query += ' ORDER BY id LIMIT ?'
+                params.append(limit)
+                cursor.execute(query, params)
+                
+                return [
+                    {
+                        'id': row[0],
+                        'source_chat': row[1],
+                        'message_id': row[2],
+                        'message_ids': json.loads(row[3]),
+                        'rule_id': row[4],
+                        'target': row[5],
+                        'error_class': row[6],
+                        'error': row[7],
+                        'attempts': row[8],
+                        'status': row[9],
+                        'failed_at': row[10],
+                        'redriven_at': row[11]
+                    }
+                    for row in cursor.fetchall()
+                ]
+                
+        except Exception as e:
+            self.logger.error(f"Error getting dead letters: {e}")
+            return []
+    
+    def count_dead_letters(self):
+        """Count dead letters per status"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT status, COUNT(*) FROM dead_letters GROUP BY status')
+                return dict(cursor.fetchall())
+                
+        except Exception as e:
+            self.logger.error(f"Error counting dead letters: {e}")
+            return {}
+    
+    def mark_dead_letters(self, ids, status):
+        """Set the status of dead letters that were re-driven or discarded"""
+        if not ids:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.executemany('''
+                    UPDATE dead_letters SET status = ?, redriven_at = CURRENT_TIMESTAMP WHERE id = ?
+                ''', [(status, dead_letter_id) for dead_letter_id in ids])
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error updating dead letters: {e}")
+            raise
+    
+    def get_source_checkpoints(self):
+        """Get the last seen message id of every source chat as {chat_id: message_id}"""
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT chat_id, last_message_id FROM source_checkpoints')
+                return {row[0]: row[1] for row in cursor.fetchall()}
+                
+        except Exception as e:
+            self.logger.error(f"Error getting source checkpoints: {e}")
+            return {}
+    
+    def save_source_checkpoints(self, checkpoints):
+        """Advance the checkpoints of several source chats in one transaction"""
+        if not checkpoints:
+            return
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Checkpoints only move forward
+                cursor.executemany('''
+                    INSERT INTO source_checkpoints (chat_id, last_message_id, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        last_message_id = MAX(last_message_id, excluded.last_message_id),
+                        updated_at = CURRENT_TIMESTAMP
+                ''', list(checkpoints.items()))
+                
+                conn.commit()
+                
+        except Exception as e:
+            self.logger.error(f"Error saving source checkpoints: {e}")
+            raise
+    
     def log_activity(self, activity_type, description, rule_id=None, details=None):
         """Log an activity event"""
         try:
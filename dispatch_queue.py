@@ -0,0 +1,312 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+
+# What to do with a message when its lane is full
+OVERFLOW_POLICIES = ('spill', 'block', 'coalesce', 'drop_oldest', 'drop_newest')
+
+# Dequeue weight of each priority level (index = priority); higher levels are served more often
+DEFAULT_PRIORITY_WEIGHTS = (1, 2, 4, 8)
+
+LATENCY_SAMPLES = 500  # Recent latencies kept per priority for percentiles
+
+# Deadline given to items without one, relative to when they are queued. Items
+# with the same horizon keep FIFO order; a key with a tighter deadline goes first,
+# but a key's own items always keep FIFO order.
+DEFAULT_DEADLINE_HORIZON = 3600
+
+
+def resolve_overflow_policy(policies, default):
+    """Overflow policy for a lane key whose rules set ``policies``.
+
+    The most conservative valid policy among them wins; ``default`` applies
+    only when none of the rules sets one.
+    """
+    policies = {policy for policy in policies if policy in OVERFLOW_POLICIES}
+    if not policies:
+        return default
+    # OVERFLOW_POLICIES is ordered from safest to most lossy
+    return min(policies, key=OVERFLOW_POLICIES.index)
+
+
+def percentile(samples, fraction):
+    """Value at a fraction (0..1) of the sorted samples, 0.0 when there are none"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class _Lane:
+    """Bounded set of per-priority queues drained by a single worker.
+
+    Levels are served by smooth weighted round-robin, so a busy low-priority
+    feed keeps making progress but cannot hold back higher priorities. Each
+    level serves the key holding the earliest deadline first, taking that
+    key's oldest item.
+    """
+
+    def __init__(self, maxsize, weights):
+        self.maxsize = maxsize
+        self.weights = weights
+        self.levels = [[] for _ in weights]  # heaps of (deadline, seq, key, item, enqueued_at)
+        self.credits = [0] * len(weights)
+        self.size = 0
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+
+    def full(self):
+        return self.maxsize > 0 and self.size >= self.maxsize
+
+    def _changed(self):
+        if self.size:
+            self.not_empty.set()
+        else:
+            self.not_empty.clear()
+        if self.full():
+            self.not_full.clear()
+        else:
+            self.not_full.set()
+
+    def remove(self, level, index):
+        """Remove and return the entry at a heap index"""
+        heap = self.levels[level]
+        entry = heap[index]
+        last = heap.pop()
+        if index < len(heap):
+            heap[index] = last
+            heapq.heapify(heap)
+        self.size -= 1
+        self._changed()
+        return entry
+
+    def next_index(self, level):
+        """Heap index of the oldest entry of the key holding the earliest deadline"""
+        heap = self.levels[level]
+        key = heap[0][2]
+        return min((i for i, entry in enumerate(heap) if entry[2] == key), key=lambda i: heap[i][1])
+
+    def next_level(self):
+        """Pick the level to serve next (smooth weighted round-robin over non-empty levels)"""
+        best = None
+        total = 0
+        for level, items in enumerate(self.levels):
+            if not items:
+                continue
+            self.credits[level] += self.weights[level]
+            total += self.weights[level]
+            if best is None or self.credits[level] > self.credits[best]:
+                best = level
+        self.credits[best] -= total
+        return best
+
+
+class ShardedQueue:
+    """A set of lanes where each key (chat ID) always maps to the same lane.
+
+    One worker drains each lane, so messages from the same chat and of the
+    same priority are handled in arrival order while different chats are
+    processed in parallel. Within a lane, priority levels are weighted and
+    each level picks the chat with the earliest deadline first; a tight
+    deadline moves its chat ahead but never reorders that chat's messages.
+    """
+
+    def __init__(self, shards, maxsize=100, weights=DEFAULT_PRIORITY_WEIGHTS):
+        self.shards = max(1, int(shards))
+        self.maxsize = maxsize
+        self.weights = tuple(max(1, int(w)) for w in weights) or DEFAULT_PRIORITY_WEIGHTS
+        self.lanes = [_Lane(maxsize, self.weights) for _ in range(self.shards)]
+        self.max_depths = [0] * self.shards
+        self.processed = [0] * self.shards
+        self.pending_by_key = Counter()
+        self.high_water = 0
+        self._sequence = itertools.count()  # Tie-breaker keeping FIFO order among equal deadlines
+
+        # Overflow and latency metrics
+        self.counters = Counter()  # enqueued, dropped_oldest, dropped_newest, coalesced, spilled, blocked
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.priority_stats = [
+            {'enqueued': 0, 'dequeued': 0, 'wait_total': 0.0, 'wait_max': 0.0,
+             'completed': 0, 'latencies': deque(maxlen=LATENCY_SAMPLES)}
+            for _ in self.weights
+        ]
+
+    def shard_for(self, key):
+        """Lane index for a key"""
+        return hash(key) % self.shards
+
+    def level_for(self, priority):
+        """Clamp a rule priority to an existing level"""
+        return min(max(int(priority or 0), 0), len(self.weights) - 1)
+
+    def put_nowait(self, key, item, priority=0, deadline=None):
+        """Queue an item on its key's lane; raises asyncio.QueueFull if that lane is full.
+
+        ``deadline`` is a wall-clock timestamp (time.time()) by which the item
+        should be handled; it only affects ordering.
+        """
+        shard = self.shard_for(key)
+        lane = self.lanes[shard]
+        if lane.full():
+            raise asyncio.QueueFull
+        level = self.level_for(priority)
+        if deadline is None:
+            deadline = time.time() + DEFAULT_DEADLINE_HORIZON
+        heapq.heappush(lane.levels[level], (deadline, next(self._sequence), key, item, time.monotonic()))
+        lane.size += 1
+        lane._changed()
+
+        self.pending_by_key[key] += 1
+        self.counters['enqueued'] += 1
+        self.priority_stats[level]['enqueued'] += 1
+        if lane.size > self.max_depths[shard]:
+            self.max_depths[shard] = lane.size
+        total = self.qsize()
+        if total > self.high_water:
+            self.high_water = total
+        return shard
+
+    async def put(self, key, item, priority=0, deadline=None, timeout=None):
+        """Queue an item, waiting up to timeout seconds for room; raises asyncio.QueueFull on timeout"""
+        lane = self.lanes[self.shard_for(key)]
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        if lane.full():
+            self.counters['blocked'] += 1
+        while True:
+            try:
+                return self.put_nowait(key, item, priority, deadline)
+            except asyncio.QueueFull:
+                remaining = None if give_up_at is None else give_up_at - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise
+                try:
+                    await asyncio.wait_for(lane.not_full.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    raise asyncio.QueueFull
+
+    async def wait_for_room(self, key):
+        """Wait until key's lane is not full"""
+        lane = self.lanes[self.shard_for(key)]
+        while lane.full():
+            await lane.not_full.wait()
+
+    def _remove(self, shard, level, index):
+        _, _, key, item, _ = self.lanes[shard].remove(level, index)
+        self._forget_key(key)
+        return item
+
+    def _forget_key(self, key):
+        self.pending_by_key[key] -= 1
+        if self.pending_by_key[key] <= 0:
+            del self.pending_by_key[key]
+
+    def drop_oldest(self, key):
+        """Remove and return the oldest lowest-priority item on key's lane, or None if it is empty"""
+        shard = self.shard_for(key)
+        for level, heap in enumerate(self.lanes[shard].levels):
+            if heap:
+                # Oldest = lowest sequence number, not necessarily the heap top
+                index = min(range(len(heap)), key=lambda i: heap[i][1])
+                self.counters['dropped_oldest'] += 1
+                return self._remove(shard, level, index)
+        return None
+
+    def drop_oldest_for_key(self, key):
+        """Remove and return the oldest lowest-priority queued item with the same key, or None"""
+        shard = self.shard_for(key)
+        for level, heap in enumerate(self.lanes[shard].levels):
+            matches = [i for i, entry in enumerate(heap) if entry[2] == key]
+            if matches:
+                index = min(matches, key=lambda i: heap[i][1])
+                self.counters['coalesced'] += 1
+                return self._remove(shard, level, index)
+        return None
+
+    def clear(self):
+        """Drop every queued item; returns how many were dropped"""
+        dropped = self.qsize()
+        for lane in self.lanes:
+            for heap in lane.levels:
+                heap.clear()
+            lane.size = 0
+            lane._changed()
+        self.pending_by_key.clear()
+        return dropped
+
+    def record(self, event):
+        """Count an overflow outcome handled outside the queue (e.g. spilled to disk)"""
+        self.counters[event] += 1
+
+    async def get(self, shard):
+        """Wait for the next item on a lane"""
+        lane = self.lanes[shard]
+        while not lane.size:
+            await lane.not_empty.wait()
+        level = lane.next_level()
+        _, _, key, item, enqueued_at = lane.remove(level, lane.next_index(level))
+        self._forget_key(key)
+
+        waited = time.monotonic() - enqueued_at
+        self.wait_total += waited
+        if waited > self.wait_max:
+            self.wait_max = waited
+        stats = self.priority_stats[level]
+        stats['dequeued'] += 1
+        stats['wait_total'] += waited
+        if waited > stats['wait_max']:
+            stats['wait_max'] = waited
+        return item
+
+    def task_done(self, shard, priority=0, latency=None):
+        """Mark an item processed; latency is its receive-to-done time in seconds"""
+        self.processed[shard] += 1
+        if latency is not None:
+            stats = self.priority_stats[self.level_for(priority)]
+            stats['completed'] += 1
+            stats['latencies'].append(latency)
+
+    def qsize(self):
+        return sum(lane.size for lane in self.lanes)
+
+    def get_stats(self, top=5):
+        """Depth per lane, overflow counters, per-priority latency and the busiest chats"""
+        dequeued = sum(s['dequeued'] for s in self.priority_stats)
+        return {
+            'total_depth': self.qsize(),
+            'maxsize_per_lane': self.maxsize,
+            'high_water': self.high_water,
+            'counters': dict(self.counters),
+            'avg_wait_ms': round(self.wait_total * 1000 / dequeued, 1) if dequeued else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 1),
+            'priorities': [
+                {
+                    'priority': level,
+                    'weight': self.weights[level],
+                    'depth': sum(len(lane.levels[level]) for lane in self.lanes),
+                    'enqueued': stats['enqueued'],
+                    'completed': stats['completed'],
+                    'avg_wait_ms': round(stats['wait_total'] * 1000 / stats['dequeued'], 1) if stats['dequeued'] else 0.0,
+                    'max_wait_ms': round(stats['wait_max'] * 1000, 1),
+                    'p50_latency_ms': round(percentile(stats['latencies'], 0.5) * 1000, 1),
+                    'p95_latency_ms': round(percentile(stats['latencies'], 0.95) * 1000, 1)
+                }
+                for level, stats in enumerate(self.priority_stats)
+            ],
+            'lanes': [
+                {
+                    'lane': shard,
+                    'depth': lane.size,
+                    'max_depth': self.max_depths[shard],
+                    'processed': self.processed[shard]
+                }
+                for shard, lane in enumerate(self.lanes)
+            ],
+            'hot_sources': [
+                {'chat_id': key, 'pending': count, 'lane': self.shard_for(key)}
+                for key, count in self.pending_by_key.most_common(top)
+            ]
+        }
@@ -0,0 +1,57 @@
+import time
+from collections import Counter
+from telethon.errors import FloodWaitError, SlowModeWaitError
+
+# Errors that carry a server-specified wait (``seconds``) instead of a real failure
+FLOOD_ERRORS = (FloodWaitError, SlowModeWaitError)
+
+ACCOUNT = None  # Park key for waits that apply to every target
+
+
+class FloodGate:
+    """Targets (and the account) parked until their Telegram flood wait is over.
+
+    A flood wait on a send parks only that target, so other targets keep
+    flowing; a wait outside a send (e.g. resolving the target) parks the
+    whole account.
+    """
+
+    def __init__(self, margin=1.0):
+        self.margin = margin  # Extra seconds waited on top of the server's value
+        self.parked = {}      # target key (or ACCOUNT) -> time.monotonic() the wait ends
+        self.counters = Counter()  # target_waits, account_waits, rescheduled
+        self.total_wait = 0.0
+
+    def park(self, key, seconds):
+        """Park a target (or the account) for ``seconds``; never shortens an existing wait"""
+        until = time.monotonic() + float(seconds) + self.margin
+        if until > self.parked.get(key, 0):
+            self.parked[key] = until
+        self.counters['account_waits' if key is ACCOUNT else 'target_waits'] += 1
+        self.total_wait += float(seconds)
+        return until
+
+    def remaining(self, key=ACCOUNT):
+        """Seconds until a target may be sent to again, counting account-wide waits"""
+        now = time.monotonic()
+        until = self.parked.get(ACCOUNT, 0)
+        if key is not ACCOUNT:
+            until = max(until, self.parked.get(key, 0))
+        return max(0.0, until - now)
+
+    def record(self, event):
+        self.counters[event] += 1
+
+    def get_stats(self):
+        """Currently parked targets with their remaining wait, and counters"""
+        now = time.monotonic()
+        for key in [k for k, until in self.parked.items() if until <= now]:
+            del self.parked[key]
+        return {
+            'account_parked_for': round(max(0.0, self.parked.get(ACCOUNT, 0) - now), 1),
+            'parked_targets': {
+                str(key): round(until - now, 1) for key, until in self.parked.items() if key is not ACCOUNT
+            },
+            'counters': dict(self.counters),
+            'total_wait_seconds': round(self.total_wait, 1)
+        }
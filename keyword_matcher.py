@@ -0,0 +1,208 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton for case-insensitive multi-keyword matching.
+
+    Keywords are casefolded when the automaton is built; callers pass text
+    that has already been casefolded so a message is folded only once.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = []
+        self.matches_empty = False  # An empty keyword matches every text
+        self._goto = [{}]     # state -> {char: next_state}
+        self._fail = [0]      # state -> fallback state
+        self._output = [()]   # state -> indexes of keywords ending here
+
+        for keyword in keywords:
+            folded = str(keyword).casefold()
+            if not folded:
+                self.matches_empty = True
+            elif folded not in self.keywords:
+                self.keywords.append(folded)
+
+        for index, keyword in enumerate(self.keywords):
+            self._insert(keyword, index)
+        self._build_failure_links()
+
+    def _insert(self, keyword, index):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = next_state
+        self._output[state] = self._output[state] + (index,)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                # Inherit matches that end at the fallback state
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def __bool__(self):
+        return bool(self.keywords) or self.matches_empty
+
+    def _step(self, state, char):
+        goto = self._goto
+        while state and char not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(char, 0)
+
+    def search(self, text):
+        """Return the indexes of all keywords found in casefolded text"""
+        found = set()
+        state = 0
+        for char in text:
+            state = self._step(state, char)
+            if self._output[state]:
+                found.update(self._output[state])
+        return found
+
+    def contains_any(self, text):
+        """Return True as soon as any keyword is found in casefolded text"""
+        if self.matches_empty:
+            return True
+        if not self.keywords:
+            return False
+        state = 0
+        for char in text:
+            state = self._step(state, char)
+            if self._output[state]:
+                return True
+        return False
+
+
+class SharedKeywordMatcher:
+    """One automaton over the keyword filters of every rule.
+
+    A message is scanned once and the result is mapped back to the rules
+    whose include keywords hit and whose exclude keywords did not. Rules can
+    be added or removed at any time; the automaton is only rebuilt (lazily,
+    on the next match) when the overall keyword vocabulary changes.
+    """
+
+    def __init__(self):
+        self._rules = {}             # rule id -> (include keywords, exclude keywords)
+        self._include_index = {}     # keyword -> rule ids including it
+        self._exclude_index = {}     # keyword -> rule ids excluding it
+        self._include_always = set() # rule ids with an empty include keyword
+        self._exclude_always = set() # rule ids with an empty exclude keyword
+        self._automaton = KeywordAutomaton([])
+        self._dirty = False
+        self.rebuilds = 0
+
+    @staticmethod
+    def _fold(keywords):
+        return frozenset(str(k).casefold() for k in (keywords or []))
+
+    def set_rule(self, rule_id, keywords=None, exclude_keywords=None):
+        """Add or replace the keyword filters of a rule"""
+        include = self._fold(keywords)
+        exclude = self._fold(exclude_keywords)
+        if self._rules.get(rule_id) == (include, exclude):
+            return
+        self.remove_rule(rule_id)
+        self._rules[rule_id] = (include, exclude)
+        self._add_terms(rule_id, include, self._include_index, self._include_always)
+        self._add_terms(rule_id, exclude, self._exclude_index, self._exclude_always)
+
+    def remove_rule(self, rule_id):
+        """Forget a rule's keyword filters"""
+        entry = self._rules.pop(rule_id, None)
+        if entry is None:
+            return
+        include, exclude = entry
+        self._remove_terms(rule_id, include, self._include_index, self._include_always)
+        self._remove_terms(rule_id, exclude, self._exclude_index, self._exclude_always)
+
+    def clear(self):
+        """Forget every rule"""
+        self._rules.clear()
+        self._include_index.clear()
+        self._exclude_index.clear()
+        self._include_always.clear()
+        self._exclude_always.clear()
+        self._automaton = KeywordAutomaton([])
+        self._dirty = False
+
+    def _add_terms(self, rule_id, terms, index, always):
+        for term in terms:
+            if not term:
+                always.add(rule_id)
+                continue
+            if term not in self._include_index and term not in self._exclude_index:
+                self._dirty = True  # New keyword in the vocabulary
+            index.setdefault(term, set()).add(rule_id)
+
+    def _remove_terms(self, rule_id, terms, index, always):
+        for term in terms:
+            if not term:
+                always.discard(rule_id)
+                continue
+            rule_ids = index.get(term)
+            if rule_ids is None:
+                continue
+            rule_ids.discard(rule_id)
+            if not rule_ids:
+                del index[term]
+                if term not in self._include_index and term not in self._exclude_index:
+                    self._dirty = True  # Keyword left the vocabulary
+
+    def has_filters(self, rule_id):
+        entry = self._rules.get(rule_id)
+        return bool(entry and (entry[0] or entry[1]))
+
+    def _ensure_automaton(self):
+        if self._dirty:
+            vocabulary = set(self._include_index) | set(self._exclude_index)
+            self._automaton = KeywordAutomaton(sorted(vocabulary))
+            self._dirty = False
+            self.rebuilds += 1
+
+    def match(self, text, rule_ids):
+        """Return the subset of rule_ids whose keyword filters pass for casefolded text"""
+        rule_ids = set(rule_ids)
+        filtered = {rid for rid in rule_ids if self.has_filters(rid)}
+        if not filtered:
+            return rule_ids
+
+        self._ensure_automaton()
+        keywords = self._automaton.keywords
+        included = set(self._include_always)
+        excluded = set(self._exclude_always)
+        for index in self._automaton.search(text):
+            keyword = keywords[index]
+            included.update(self._include_index.get(keyword, ()))
+            excluded.update(self._exclude_index.get(keyword, ()))
+
+        passed = rule_ids - filtered
+        for rule_id in filtered:
+            include, _ = self._rules[rule_id]
+            if include and rule_id not in included:
+                continue
+            if rule_id in excluded:
+                continue
+            passed.add(rule_id)
+        return passed
+
+    def get_stats(self):
+        """Get matcher statistics"""
+        return {
+            'rules': len(self._rules),
+            'keywords': len(set(self._include_index) | set(self._exclude_index)),
+            'rebuilds': self.rebuilds
+        }
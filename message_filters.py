@@ -0,0 +1,503 @@
+"""Compiled message filters for forwarding rules.
+
+Besides ``keywords``/``exclude_keywords`` (handled by the shared keyword
+matcher), a rule's ``filters`` JSON may contain:
+
+    "regex":          "pattern" or {"pattern": "...", "ignore_case": true}
+    "media_types":    ["photo", "video", "document", "text", ...]
+    "sender_ids":     [123, 456]
+    "forwarded_from": [-1001234567890]
+    "min_length":     10
+    "max_length":     500
+    "match":          {"all": [...]} | {"any": [...]} | {"not": {...}}
+                      or any of the leaves above, e.g. {"regex": "..."}
+
+and, although they are not filters, the rule's queueing options:
+
+    "overflow_policy": "spill" | "block" | "coalesce" | "drop_oldest" | "drop_newest"
+    "max_age":         300     (seconds; older messages are late)
+    "late_action":     "skip" | "mark"   (drop late messages or send them marked as delayed)
+    "digest":          true or {"window": 60, "max_chars": 4096, "max_messages": 50}
+                       (buffer text messages and send them combined)
+    "forward_mode":    "copy" | "native"   (native: batched forward_messages, shows "Forwarded from")
+    "batch_window":    1.0     (seconds native forwards are collected before one request)
+    "max_retries":     3       (retries of a send failing on network/server errors)
+
+Top-level keys are combined with AND. Everything is compiled once into
+predicate objects; composite predicates evaluate their children cheapest
+first and short-circuit.
+"""
+import re
+import time
+import logging
+from keyword_matcher import KeywordAutomaton
+from dispatch_queue import OVERFLOW_POLICIES
+
+try:
+    import regex as regex_engine  # Supports match timeouts (in requirements.txt)
+except ImportError:
+    regex_engine = None
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {
+    'text', 'photo', 'video', 'video_note', 'gif', 'sticker', 'voice',
+    'audio', 'document', 'poll', 'contact', 'geo', 'web_preview', 'other'
+}
+
+REGEX_TIMEOUT = 0.05      # Seconds a single regex search may take
+REGEX_MAX_TEXT = 4096     # Telegram's message length limit
+REGEX_MAX_TIMEOUTS = 3    # Slow evaluations before a regex is disabled
+
+LATE_ACTIONS = ('skip', 'mark')
+FORWARD_MODES = ('copy', 'native')
+
+
+class FilterError(ValueError):
+    """Raised when a rule's filters cannot be compiled"""
+
+
+class MessageContext:
+    """Per-message values shared by every predicate evaluation"""
+
+    __slots__ = ('text', 'folded_text', 'media_type', 'sender_id', 'forwarded_from')
+
+    def __init__(self, text='', media_type='text', sender_id=None, forwarded_from=None):
+        self.text = text or ''
+        self.folded_text = self.text.casefold()
+        self.media_type = media_type
+        self.sender_id = sender_id
+        self.forwarded_from = forwarded_from
+
+
+class Predicate:
+    """Base class for compiled predicates with evaluation counters"""
+
+    cost = 1
+
+    def __init__(self):
+        self.evaluations = 0
+        self.matches = 0
+        self.total_time = 0.0
+
+    def __call__(self, ctx):
+        start = time.perf_counter()
+        result = self._test(ctx)
+        self.total_time += time.perf_counter() - start
+        self.evaluations += 1
+        if result:
+            self.matches += 1
+        return result
+
+    def _test(self, ctx):
+        raise NotImplementedError
+
+    def describe(self):
+        return self.__class__.__name__
+
+    def children(self):
+        return ()
+
+    def get_stats(self):
+        """Flatten counters for this predicate and its children"""
+        stats = [{
+            'predicate': self.describe(),
+            'evaluations': self.evaluations,
+            'matches': self.matches,
+            'total_ms': round(self.total_time * 1000, 3),
+            'avg_us': round(self.total_time * 1e6 / self.evaluations, 1) if self.evaluations else 0.0
+        }]
+        for child in self.children():
+            stats.extend(child.get_stats())
+        return stats
+
+
+class MediaTypePredicate(Predicate):
+    def __init__(self, media_types):
+        super().__init__()
+        unknown = set(media_types) - MEDIA_TYPES
+        if unknown:
+            raise FilterError(f"Unknown media types: {', '.join(sorted(unknown))}")
+        self.media_types = frozenset(media_types)
+
+    def _test(self, ctx):
+        return ctx.media_type in self.media_types
+
+    def describe(self):
+        return f"media_types={sorted(self.media_types)}"
+
+
+class IdSetPredicate(Predicate):
+    """Matches when a context attribute is one of a set of chat/user IDs"""
+
+    def __init__(self, attribute, ids):
+        super().__init__()
+        try:
+            # Absolute values, like rule sources, so marked and bare IDs both work
+            self.ids = frozenset(abs(int(i)) for i in ids)
+        except (TypeError, ValueError):
+            raise FilterError(f"{attribute} must be a list of numeric IDs")
+        self.attribute = attribute
+
+    def _test(self, ctx):
+        value = getattr(ctx, self.attribute)
+        return value is not None and abs(value) in self.ids
+
+    def describe(self):
+        return f"{self.attribute}={sorted(self.ids)}"
+
+
+class LengthPredicate(Predicate):
+    def __init__(self, min_length=None, max_length=None):
+        super().__init__()
+        try:
+            self.min_length = int(min_length) if min_length is not None else None
+            self.max_length = int(max_length) if max_length is not None else None
+        except (TypeError, ValueError):
+            raise FilterError("min_length/max_length must be integers")
+
+    def _test(self, ctx):
+        length = len(ctx.text)
+        if self.min_length is not None and length < self.min_length:
+            return False
+        if self.max_length is not None and length > self.max_length:
+            return False
+        return True
+
+    def describe(self):
+        return f"length[{self.min_length}..{self.max_length}]"
+
+
+class KeywordPredicate(Predicate):
+    cost = 5
+
+    def __init__(self, keywords):
+        super().__init__()
+        if not isinstance(keywords, list):
+            raise FilterError("keywords must be a list")
+        self.automaton = KeywordAutomaton(keywords)
+
+    def _test(self, ctx):
+        return self.automaton.contains_any(ctx.folded_text)
+
+    def describe(self):
+        return f"keywords({len(self.automaton.keywords)})"
+
+
+class RegexPredicate(Predicate):
+    cost = 10
+
+    def __init__(self, pattern, ignore_case=False):
+        super().__init__()
+        flags = re.IGNORECASE if ignore_case else 0
+        engine = regex_engine or re
+        try:
+            self.regex = engine.compile(pattern, flags)
+        except Exception as e:
+            raise FilterError(f"Invalid regex {pattern!r}: {e}")
+        # Without a match timeout, catastrophic backtracking would block the event loop
+        if regex_engine is None:
+            parsed = sre_parse.parse(pattern, flags)
+            if _backtracks_exponentially(parsed, fold=bool(parsed.state.flags & re.IGNORECASE)):
+                raise FilterError(
+                    f"Regex {pattern!r} repeats a repeated group or overlapping alternatives "
+                    f"(e.g. (a+)+ or (a|aa)+); install 'regex' to allow it"
+                )
+        self.pattern = pattern
+        self.timeouts = 0
+        self.disabled = False
+
+    def _test(self, ctx):
+        if self.disabled:
+            return False
+
+        text = ctx.text[:REGEX_MAX_TEXT]
+        start = time.perf_counter()
+        try:
+            if regex_engine:
+                found = self.regex.search(text, timeout=REGEX_TIMEOUT) is not None
+            else:
+                found = self.regex.search(text) is not None
+        except TimeoutError:
+            found = False
+
+        # The stdlib engine can't be interrupted; disable patterns that keep running long
+        if time.perf_counter() - start > REGEX_TIMEOUT:
+            self.timeouts += 1
+            if self.timeouts >= REGEX_MAX_TIMEOUTS:
+                self.disabled = True
+                logger.warning(f"Disabling slow regex filter {self.pattern!r} after {self.timeouts} timeouts")
+            return False
+        return found
+
+    def describe(self):
+        return f"regex({self.pattern!r})" + (" [disabled]" if self.disabled else "")
+
+
+class AllOf(Predicate):
+    def __init__(self, predicates):
+        super().__init__()
+        # Cheapest first so expensive checks run only when needed
+        self.predicates = sorted(predicates, key=lambda p: p.cost)
+        self.cost = sum(p.cost for p in self.predicates)
+
+    def _test(self, ctx):
+        return all(p(ctx) for p in self.predicates)
+
+    def describe(self):
+        return f"all({len(self.predicates)})"
+
+    def children(self):
+        return self.predicates
+
+
+class AnyOf(AllOf):
+    def _test(self, ctx):
+        return any(p(ctx) for p in self.predicates)
+
+    def describe(self):
+        return f"any({len(self.predicates)})"
+
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        super().__init__()
+        self.predicate = predicate
+        self.cost = predicate.cost
+
+    def _test(self, ctx):
+        return not self.predicate(ctx)
+
+    def describe(self):
+        return "not"
+
+    def children(self):
+        return (self.predicate,)
+
+
+_REPEATS = tuple(
+    getattr(sre_parse, name) for name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT') if hasattr(sre_parse, name)
+)
+
+
+# Character classes are compared on the code points below this
+_PROBE_SIZE = 0x800
+_ALL_CHARS = frozenset(range(_PROBE_SIZE))
+_CATEGORY_PATTERNS = {
+    'CATEGORY_DIGIT': r'\d', 'CATEGORY_NOT_DIGIT': r'\D',
+    'CATEGORY_SPACE': r'\s', 'CATEGORY_NOT_SPACE': r'\S',
+    'CATEGORY_WORD': r'\w', 'CATEGORY_NOT_WORD': r'\W',
+}
+_category_chars = {}  # category -> code points it matches
+
+
+def _category(category):
+    chars = _category_chars.get(category)
+    if chars is None:
+        pattern = re.compile(_CATEGORY_PATTERNS.get(str(category), r'[\s\S]'))
+        chars = _category_chars[category] = frozenset(c for c in _ALL_CHARS if pattern.match(chr(c)))
+    return chars
+
+
+def _char_set(op, av, fold):
+    """Code points a single-character item can match, or None if the item is not one"""
+    if op == sre_parse.LITERAL:
+        chars = {av}
+    elif op == sre_parse.NOT_LITERAL:
+        return _ALL_CHARS - {av}
+    elif op == sre_parse.ANY:
+        return _ALL_CHARS
+    elif op == sre_parse.IN:
+        chars = set()
+        negate = False
+        for item_op, item_av in av:
+            if item_op == sre_parse.NEGATE:
+                negate = True
+            elif item_op == sre_parse.LITERAL:
+                chars.add(item_av)
+            elif item_op == sre_parse.RANGE:
+                chars.update(range(item_av[0], item_av[1] + 1))
+            elif item_op == sre_parse.CATEGORY:
+                chars |= _category(item_av)
+            else:
+                return _ALL_CHARS
+        if negate:
+            return _ALL_CHARS - chars
+    else:
+        return None
+    if fold:
+        chars |= {ord(chr(c).lower()[0]) for c in chars} | {ord(chr(c).upper()[0]) for c in chars}
+    return chars
+
+
+def _first_chars(items, fold):
+    """Code points a sequence can start with; every code point when unsure or when it may match empty"""
+    chars = set()
+    for op, av in items:
+        single = _char_set(op, av, fold)
+        if single is not None:
+            return chars | single
+        if op in _REPEATS:
+            low, _, sub = av
+            chars |= _first_chars(sub, fold)
+            if low > 0:
+                return chars
+        elif op == sre_parse.SUBPATTERN:
+            return chars | _first_chars(av[-1], fold)
+        elif op == sre_parse.BRANCH:
+            return chars.union(*(_first_chars(branch, fold) for branch in av[1]))
+        elif op != sre_parse.AT:
+            return _ALL_CHARS
+    return _ALL_CHARS
+
+
+def _may_overlap(a, b, fold):
+    """False when two alternatives can't match the same text: some position where their characters differ"""
+    for i, ((op_a, av_a), (op_b, av_b)) in enumerate(zip(a, b)):
+        chars_a = _char_set(op_a, av_a, fold)
+        chars_b = _char_set(op_b, av_b, fold)
+        if chars_a is None or chars_b is None:
+            return bool(_first_chars(a[i:], fold) & _first_chars(b[i:], fold))
+        if not chars_a & chars_b:
+            return False
+    # One alternative can match a prefix of the other, e.g. (a|aa)
+    return True
+
+
+def _backtracks_exponentially(parsed, repeated=False, fold=False):
+    """True if a repeated group contains a variable-length repeat, or alternatives that can
+    match the same text: the shapes behind exponential backtracking
+    """
+    for op, av in parsed:
+        if op in _REPEATS:
+            low, high, sub = av
+            if repeated and high > low:
+                return True
+            if _backtracks_exponentially(sub, repeated or high > 1, fold):
+                return True
+        elif op == sre_parse.SUBPATTERN:
+            if _backtracks_exponentially(av[-1], repeated, fold):
+                return True
+        elif op == sre_parse.BRANCH:
+            branches = [list(branch) for branch in av[1]]
+            if repeated and any(_may_overlap(a, b, fold) for i, a in enumerate(branches) for b in branches[i + 1:]):
+                return True
+            if any(_backtracks_exponentially(branch, repeated, fold) for branch in branches):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT, getattr(sre_parse, 'ATOMIC_GROUP', None)):
+            sub = av[1] if isinstance(av, tuple) else av
+            if _backtracks_exponentially(sub, repeated, fold):
+                return True
+    return False
+
+
+def _compile_regex(spec):
+    if isinstance(spec, str):
+        return RegexPredicate(spec)
+    if isinstance(spec, dict) and 'pattern' in spec:
+        return RegexPredicate(spec['pattern'], bool(spec.get('ignore_case')))
+    raise FilterError("regex must be a pattern string or {'pattern': ...}")
+
+
+def _compile_leaves(spec):
+    """Compile the leaf keys of a filter dict into predicates"""
+    predicates = []
+    if spec.get('regex'):
+        predicates.append(_compile_regex(spec['regex']))
+    if spec.get('media_types'):
+        predicates.append(MediaTypePredicate(spec['media_types']))
+    if spec.get('sender_ids'):
+        predicates.append(IdSetPredicate('sender_id', spec['sender_ids']))
+    if spec.get('forwarded_from'):
+        predicates.append(IdSetPredicate('forwarded_from', spec['forwarded_from']))
+    if spec.get('min_length') is not None or spec.get('max_length') is not None:
+        predicates.append(LengthPredicate(spec.get('min_length'), spec.get('max_length')))
+    return predicates
+
+
+def compile_expression(spec):
+    """Compile a ``match`` expression node"""
+    if not isinstance(spec, dict) or not spec:
+        raise FilterError("Filter expressions must be non-empty objects")
+
+    if 'all' in spec or 'any' in spec:
+        key = 'all' if 'all' in spec else 'any'
+        items = spec[key]
+        if not isinstance(items, list) or not items:
+            raise FilterError(f"'{key}' must be a non-empty list")
+        children = [compile_expression(item) for item in items]
+        return AllOf(children) if key == 'all' else AnyOf(children)
+
+    if 'not' in spec:
+        return Not(compile_expression(spec['not']))
+
+    predicates = _compile_leaves(spec)
+    if spec.get('keywords'):
+        predicates.append(KeywordPredicate(spec['keywords']))
+    if not predicates:
+        raise FilterError(f"Unknown filter expression: {sorted(spec)}")
+    return predicates[0] if len(predicates) == 1 else AllOf(predicates)
+
+
+def _check_digest(digest):
+    if digest is None or isinstance(digest, bool):
+        return
+    if not isinstance(digest, dict):
+        raise FilterError("digest must be true/false or an object")
+    for key in ('window', 'max_chars', 'max_messages'):
+        if key in digest:
+            try:
+                if float(digest[key]) <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise FilterError(f"digest.{key} must be a positive number")
+
+
+def compile_filters(filters):
+    """Compile a rule's filters into a predicate, or None if nothing to check.
+
+    ``keywords``/``exclude_keywords`` are left to the shared keyword matcher.
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise FilterError("Filters must be an object")
+    policy = filters.get('overflow_policy')
+    if policy is not None and policy not in OVERFLOW_POLICIES:
+        raise FilterError(f"overflow_policy must be one of: {', '.join(OVERFLOW_POLICIES)}")
+    if filters.get('max_age') is not None:
+        try:
+            if float(filters['max_age']) <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise FilterError("max_age must be a positive number of seconds")
+    if filters.get('late_action', 'skip') not in LATE_ACTIONS:
+        raise FilterError(f"late_action must be one of: {', '.join(LATE_ACTIONS)}")
+    _check_digest(filters.get('digest'))
+    if filters.get('forward_mode', 'copy') not in FORWARD_MODES:
+        raise FilterError(f"forward_mode must be one of: {', '.join(FORWARD_MODES)}")
+    if filters.get('batch_window') is not None:
+        try:
+            if float(filters['batch_window']) <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise FilterError("batch_window must be a positive number of seconds")
+    if filters.get('max_retries') is not None:
+        try:
+            if int(filters['max_retries']) < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            raise FilterError("max_retries must be a non-negative integer")
+
+    predicates = _compile_leaves(filters)
+    if filters.get('match'):
+        predicates.append(compile_expression(filters['match']))
+
+    if not predicates:
+        return None
+    return predicates[0] if len(predicates) == 1 else AllOf(predicates)
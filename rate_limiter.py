@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Token bucket refilled at ``rate`` tokens per second up to ``burst``.
+
+    Reservations may take the bucket below zero; the deficit is the time the
+    caller has to wait, so concurrent callers are spaced out instead of all
+    waking at once.
+    """
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'reservations', 'waits', 'wait_total', 'wait_max')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.reservations = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def level(self):
+        """Tokens available right now (negative while reservations are waiting)"""
+        self._refill(time.monotonic())
+        return self.tokens
+
+    def reserve(self):
+        """Take a token; returns the seconds until it may be used"""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        self.reservations += 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def record_wait(self, waited):
+        if waited > 0:
+            self.waits += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+
+    def reconfigure(self, rate, burst):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, float(burst))
+
+    def get_stats(self):
+        return {
+            'tokens': round(self.level(), 2),
+            'rate_per_minute': round(self.rate * 60, 2),
+            'burst': self.burst,
+            'sends': self.reservations,
+            'waits': self.waits,
+            'avg_wait_ms': round(self.wait_total * 1000 / self.waits, 1) if self.waits else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 1)
+        }
+
+
+class TargetRateLimiter:
+    """Per-target token buckets under one account-wide bucket.
+
+    A send needs a token from its target's bucket and from the account
+    bucket, so a busy target only uses up its own budget while independent
+    targets share the account budget.
+    """
+
+    def __init__(self, target_rate=60, target_burst=5, account_rate=60, account_burst=60):
+        # Rates are in messages per minute
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.account = TokenBucket(account_rate / 60.0, account_burst)
+        self.targets = {}  # target key -> TokenBucket
+
+    def configure(self, target_rate=None, target_burst=None, account_rate=None, account_burst=None):
+        """Change budgets; buckets keep their current level"""
+        if target_rate is not None:
+            self.target_rate = target_rate
+        if target_burst is not None:
+            self.target_burst = target_burst
+        for bucket in self.targets.values():
+            bucket.reconfigure(self.target_rate / 60.0, self.target_burst)
+        self.account.reconfigure(
+            (account_rate if account_rate is not None else self.account.rate * 60) / 60.0,
+            account_burst if account_burst is not None else self.account.burst
+        )
+
+    def _bucket(self, key):
+        bucket = self.targets.get(key)
+        if bucket is None:
+            bucket = self.targets[key] = TokenBucket(self.target_rate / 60.0, self.target_burst)
+        return bucket
+
+    def reserve(self, key):
+        """Reserve a send to a target; returns the seconds until it may go out"""
+        bucket = self._bucket(key)
+        target_delay = bucket.reserve()
+        account_delay = self.account.reserve()
+        # Each bucket's stats show the waits it caused
+        bucket.record_wait(target_delay)
+        self.account.record_wait(account_delay)
+        return max(target_delay, account_delay)
+
+    async def acquire(self, key):
+        """Wait until a send to a target is within budget; returns the seconds waited"""
+        delay = self.reserve(key)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def get_stats(self, top=20):
+        """Account bucket plus the targets that waited the longest"""
+        busiest = sorted(self.targets.items(), key=lambda item: item[1].wait_total, reverse=True)[:top]
+        return {
+            'target_rate_per_minute': self.target_rate,
+            'target_burst': self.target_burst,
+            'account': self.account.get_stats(),
+            'targets': {str(key): bucket.get_stats() for key, bucket in busiest}
+        }
@@ -0,0 +1,25 @@
+import asyncio
+import random
+from telethon.errors import PeerFloodError, ServerError, TimedOutError
+
+# Send errors worth retrying: the network or Telegram's servers, not the request.
+# Flood waits are not listed; they park the target (see flood_control).
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, ServerError, TimedOutError)
+
+# Errors meaning Telegram restricts the account itself; these still count
+# towards the error cooldown instead of only failing one send
+RESTRICTION_ERRORS = (PeerFloodError,)
+
+
+def is_transient(error):
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+def backoff_delay(attempt, base=2.0, cap=300.0):
+    """Seconds before retry number ``attempt`` (1-based).
+
+    Doubles with every attempt up to ``cap``; a random point in the upper
+    half of that window keeps retries of a burst of failures apart.
+    """
+    ceiling = min(cap, base * 2 ** (max(1, attempt) - 1))
+    return random.uniform(ceiling / 2, ceiling)
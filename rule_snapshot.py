@@ -0,0 +1,60 @@
+class RuleSnapshot:
+    """Immutable, versioned view of the active forwarding rules.
+
+    Workers read the current snapshot once per message. Rule changes build a
+    new snapshot with ``evolve`` and swap it in with a single assignment, so a
+    message is never matched against a half-updated rule set.
+    """
+
+    __slots__ = ('version', 'rules', 'routes', 'unrouted', 'predicates')
+
+    def __init__(self, version=0, rules=None, routes=None, unrouted=None, predicates=None):
+        self.version = version
+        self.rules = rules or {}            # rule id -> rule dict, in insertion order
+        self.routes = routes or {}          # abs(chat_id) -> tuple of rules (abs keeps the legacy ID match)
+        self.unrouted = unrouted or {}      # rule id -> rule whose source is unresolved
+        self.predicates = predicates or {}  # rule id -> compiled filter predicate
+
+    def __len__(self):
+        return len(self.rules)
+
+    def evolve(self, upserts=(), removals=()):
+        """Return a new snapshot with rules replaced/added and removed.
+
+        ``upserts`` is an iterable of (rule, predicate) pairs; a rule replaces
+        any existing rule with the same id. Rule dicts are treated as
+        immutable: callers pass new dicts rather than mutating old ones.
+        """
+        rules = dict(self.rules)
+        routes = dict(self.routes)
+        unrouted = dict(self.unrouted)
+        predicates = dict(self.predicates)
+
+        def drop(rule_id):
+            old = rules.pop(rule_id, None)
+            unrouted.pop(rule_id, None)
+            predicates.pop(rule_id, None)
+            if old is None or old.get('source_chat_id') is None:
+                return
+            key = abs(old['source_chat_id'])
+            bucket = tuple(r for r in routes.get(key, ()) if r['id'] != rule_id)
+            if bucket:
+                routes[key] = bucket
+            else:
+                routes.pop(key, None)
+
+        for rule_id in removals:
+            drop(rule_id)
+
+        for rule, predicate in upserts:
+            drop(rule['id'])
+            rules[rule['id']] = rule
+            if predicate:
+                predicates[rule['id']] = predicate
+            if rule.get('source_chat_id') is None:
+                unrouted[rule['id']] = rule
+            else:
+                key = abs(rule['source_chat_id'])
+                routes[key] = routes.get(key, ()) + (rule,)
+
+        return RuleSnapshot(self.version + 1, rules, routes, unrouted, predicates)
@@ -0,0 +1,159 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+
+
+class SendScheduler:
+    """Timer heap of sends, each started once its scheduled time has come.
+
+    Workers schedule a send and move on instead of sleeping out pacing
+    delays. At most ``max_in_flight`` sends run at once, and sends with the
+    same key (target) run one at a time in the order they were scheduled.
+    A send can also wait for another future (``after``) without taking a
+    slot; later sends to its key wait behind it.
+    """
+
+    def __init__(self, max_in_flight=5):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.heap = []        # (send_at, seq, key, factory, future, after)
+        self.blocked = {}     # key -> deque of due entries waiting for that key's send in flight
+        self.busy = set()     # Keys with a send in flight or waiting for its ``after``
+        self.waiting = {}     # key -> due entry waiting for its ``after``
+        self.running = set()  # Tasks of sends in flight
+        self.last_send_at = {}  # key -> latest scheduled time, keeps each key's sends in order
+        self.wakeup = asyncio.Event()
+        self._sequence = itertools.count()
+        self.counters = Counter()  # scheduled, started, completed, failed, cancelled
+        self.lateness_total = 0.0
+        self.lateness_max = 0.0
+
+    def schedule(self, delay, key, factory, after=None):
+        """Run factory() at least ``delay`` seconds from now, and not before ``after`` is done;
+        returns a future with its result"""
+        send_at = max(time.monotonic() + max(0.0, delay), self.last_send_at.get(key, 0))
+        self.last_send_at[key] = send_at
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.heap, (send_at, next(self._sequence), key, factory, future, after))
+        self.counters['scheduled'] += 1
+        self.wakeup.set()
+        return future
+
+    async def run(self):
+        """Start sends as they come due; runs until cancelled"""
+        while True:
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now and len(self.running) < self.max_in_flight:
+                entry = heapq.heappop(self.heap)
+                if entry[4].cancelled():
+                    if entry[2] not in self.busy:
+                        self._release_next(entry[2])
+                    continue
+                if entry[2] in self.busy:
+                    self.blocked.setdefault(entry[2], deque()).append(entry)
+                    continue
+                after = entry[5]
+                if after is not None and not after.done():
+                    self.busy.add(entry[2])
+                    self.waiting[entry[2]] = entry
+                    after.add_done_callback(lambda _, entry=entry: self._ready(entry))
+                    continue
+                self._start(entry, now)
+
+            timeout = None
+            if self.heap and len(self.running) < self.max_in_flight:
+                timeout = max(0.0, self.heap[0][0] - now)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _ready(self, entry):
+        """An entry's ``after`` is done: put it back on the heap, still ahead of its key's later sends"""
+        key = entry[2]
+        if self.waiting.get(key) is not entry:
+            return  # Cleared meanwhile
+        del self.waiting[key]
+        self.busy.discard(key)
+        heapq.heappush(self.heap, entry)
+        self.wakeup.set()
+
+    def _start(self, entry, now):
+        send_at, _, key, factory, future, _ = entry
+        late = now - send_at
+        self.lateness_total += late
+        if late > self.lateness_max:
+            self.lateness_max = late
+        self.counters['started'] += 1
+        self.busy.add(key)
+        task = asyncio.create_task(self._send(key, factory, future))
+        self.running.add(task)
+
+    async def _send(self, key, factory, future):
+        try:
+            result = await factory()
+            self.counters['completed'] += 1
+            if not future.done():
+                future.set_result(result)
+        except asyncio.CancelledError:
+            self.counters['cancelled'] += 1
+            future.cancel()
+            raise
+        except Exception as e:
+            self.counters['failed'] += 1
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            # Free the slot before waking the dispatcher
+            self.running.discard(asyncio.current_task())
+            self.busy.discard(key)
+            self._release_next(key)
+            self.wakeup.set()
+
+    def _release_next(self, key):
+        """Put the next blocked send to a key back on the heap, still ahead of later ones"""
+        waiting = self.blocked.get(key)
+        if waiting:
+            heapq.heappush(self.heap, waiting.popleft())
+            if not waiting:
+                del self.blocked[key]
+
+    def pending(self):
+        """Sends scheduled but not started"""
+        return len(self.heap) + len(self.waiting) + sum(len(waiting) for waiting in self.blocked.values())
+
+    async def clear(self):
+        """Cancel every pending and in-flight send; returns how many were cancelled"""
+        entries = self.heap + list(self.waiting.values()) + [entry for waiting in self.blocked.values() for entry in waiting]
+        self.heap = []
+        self.blocked.clear()
+        self.waiting.clear()
+        self.last_send_at.clear()
+        for entry in entries:
+            entry[4].cancel()
+        running = list(self.running)
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(running)
+        self.running.clear()
+        self.busy.clear()
+        return len(entries) + len(running)
+
+    def get_stats(self):
+        """Pending and in-flight sends and how late they started"""
+        started = self.counters['started']
+        next_in = round(max(0.0, self.heap[0][0] - time.monotonic()), 2) if self.heap else None
+        return {
+            'pending': self.pending(),
+            'in_flight': len(self.running),
+            'max_in_flight': self.max_in_flight,
+            'blocked_keys': len(self.blocked),
+            'waiting_on_other_sends': len(self.waiting),
+            'next_send_in': next_in,
+            'counters': dict(self.counters),
+            'avg_start_lateness_ms': round(self.lateness_total * 1000 / started, 1) if started else 0.0,
+            'max_start_lateness_ms': round(self.lateness_max * 1000, 1)
+        }
@@ -25,7 +25,7 @@ fi
 
 # Check if required dependencies are installed
 echo "📦 Checking dependencies..."
-python -c "import flask, telethon, asyncio_throttle" 2>/dev/null
+python -c "import flask, telethon" 2>/dev/null
 if [ $? -ne 0 ]; then
     echo "❌ Missing dependencies!"
     echo "Please run: ./deploy.sh first"
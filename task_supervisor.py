@@ -0,0 +1,74 @@
+import asyncio
+import logging
+
+
+class TaskSupervisor:
+    """Owns named background tasks and restarts any that crash.
+
+    Spawning a name that is already running is a no-op, so start paths can
+    be called repeatedly without duplicating work.
+    """
+
+    def __init__(self, restart_delay=1.0, logger=None):
+        self.restart_delay = restart_delay
+        self.logger = logger or logging.getLogger(__name__)
+        self.tasks = {}     # name -> asyncio.Task
+        self.restarts = {}  # name -> number of crash restarts
+
+    def spawn(self, name, factory):
+        """Run factory() as a supervised task unless a task with this name is alive"""
+        task = self.tasks.get(name)
+        if task and not task.done():
+            return task
+        task = asyncio.create_task(self._run(name, factory), name=name)
+        self.tasks[name] = task
+        return task
+
+    async def _run(self, name, factory):
+        while True:
+            try:
+                return await factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.restarts[name] = self.restarts.get(name, 0) + 1
+                self.logger.error(f"Task {name} crashed ({e}); restarting in {self.restart_delay}s")
+                await asyncio.sleep(self.restart_delay)
+
+    def running(self, prefix=''):
+        """Names of live tasks, optionally only those starting with prefix"""
+        return [name for name, task in self.tasks.items() if name.startswith(prefix) and not task.done()]
+
+    async def stop(self, names=None, timeout=None, cancel=()):
+        """Stop tasks: those in ``cancel`` at once, the rest after up to ``timeout`` seconds.
+
+        Returns (finished, cancelled) counts.
+        """
+        names = [name for name in (names if names is not None else list(self.tasks)) if name in self.tasks]
+        for name in cancel:
+            if name in self.tasks:
+                self.tasks[name].cancel()
+
+        pending = [self.tasks[name] for name in names if not self.tasks[name].done()]
+        if pending:
+            _, still_running = await asyncio.wait(pending, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.wait(still_running)
+        else:
+            still_running = set()
+
+        cancelled = 0
+        for name in names:
+            task = self.tasks.pop(name)
+            if task.cancelled() or task in still_running:
+                cancelled += 1
+        return len(names) - cancelled, cancelled
+
+    def get_stats(self):
+        """Live tasks and crash restarts"""
+        return {
+            'running': sorted(self.running()),
+            'restarts': dict(self.restarts)
+        }
@@ -2,19 +2,48 @@ import os
 import logging
 import asyncio
 import random
+import time
+import io
 import json
+import hashlib
+from collections import Counter, deque
 from datetime import datetime, timedelta
-from telethon import TelegramClient, events
+from telethon import TelegramClient, events, utils
 from telethon.errors import *
-from asyncio_throttle import Throttler
-from asyncio import Queue, Semaphore
 from typing import List, Dict, Any
 from telethon.tl.types import PeerChannel, PeerChat, PeerUser
 from fake_useragent import UserAgent
 from dotenv import load_dotenv
+from caches import TTLCache
+from keyword_matcher import SharedKeywordMatcher
+from message_filters import MessageContext, FilterError, compile_filters
+from rule_snapshot import RuleSnapshot
+from dispatch_queue import ShardedQueue, OVERFLOW_POLICIES, LATENCY_SAMPLES, percentile, resolve_overflow_policy
+from task_supervisor import TaskSupervisor
+from flood_control import FloodGate, FLOOD_ERRORS, ACCOUNT
+from rate_limiter import TargetRateLimiter
+from send_scheduler import SendScheduler
+from retry_policy import RESTRICTION_ERRORS, is_transient, backoff_delay
+from database import DatabaseManager
 
 load_dotenv()
 
+MAX_MESSAGE_LENGTH = 4096  # Telegram's text message limit
+FORWARD_BATCH_MAX = 100    # Message ids Telegram accepts in one forward_messages call
+
+# stop_forwarding returns within STOP_TIMEOUT_MAX seconds, under async_helper's 30s call
+# timeout; JOURNAL_STOP_RESERVE of it is kept for writing out the ingest journal
+STOP_TIMEOUT_MAX = 25.0
+JOURNAL_STOP_RESERVE = 2.0
+
+# Settings (see /api/settings) that override the rate limiter: key -> (option, type)
+RATE_SETTINGS = {
+    'target_messages_per_minute': ('target_rate', float),
+    'target_burst': ('target_burst', int),
+    'account_messages_per_minute': ('account_rate', float),
+    'account_burst': ('account_burst', int),
+}
+
 class SimpleTelegramClient:
     def __init__(self):
         # Use more reliable API credentials for better SMS delivery
@@ -50,9 +79,17 @@ class SimpleTelegramClient:
         # Fast mode settings
         self.instant_mode = os.getenv('INSTANT_FORWARDING', 'true').lower() == 'true'
         
-        # Rate limiting - more permissive for instant forwarding
+        # Rate limiting - a budget per target under an account-wide budget (messages per minute),
+        # more permissive for instant forwarding; overridable from the settings. A target gets
+        # the whole account budget unless TARGET_MESSAGES_PER_MINUTE lowers it
         rate_limit = 60 if self.instant_mode else self.max_messages_per_minute
-        self.throttler = Throttler(rate_limit=rate_limit, period=60)
+        account_rate = float(os.getenv('ACCOUNT_MESSAGES_PER_MINUTE', rate_limit))
+        self.rate_limiter = TargetRateLimiter(
+            target_rate=float(os.getenv('TARGET_MESSAGES_PER_MINUTE', account_rate)),
+            target_burst=int(os.getenv('TARGET_BURST', 5)),
+            account_rate=account_rate,
+            account_burst=int(os.getenv('ACCOUNT_BURST', rate_limit))
+        )
         
         self.daily_forward_count = 0
         self.last_reset_date = datetime.now().date()
@@ -64,10 +101,80 @@ class SimpleTelegramClient:
         self.cooldown_hours = int(os.getenv('COOLDOWN_HOURS', 2))
         
         # Concurrent processing
-        self.message_queue = Queue(maxsize=100)  # Queue for incoming messages
         self.max_concurrent_forwards = int(os.getenv('MAX_CONCURRENT_FORWARDS', 5))
-        self.semaphore = Semaphore(self.max_concurrent_forwards)
+        # One ordered lane per worker; a chat always lands on the same lane
+        self.queue_maxsize = int(os.getenv('QUEUE_MAXSIZE', 100))
+        # Relative dequeue weight of each rule priority (0 = lowest)
+        self.priority_weights = [int(w) for w in os.getenv('PRIORITY_WEIGHTS', '1,2,4,8').split(',') if w.strip()]
+        self.message_queue = ShardedQueue(
+            self.max_concurrent_forwards, maxsize=self.queue_maxsize, weights=self.priority_weights
+        )
+        # What to do when a lane is full; rules can override it with filters['overflow_policy']
+        self.overflow_policy = os.getenv('QUEUE_OVERFLOW_POLICY', 'spill').lower()
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            self.overflow_policy = 'spill'
+        self.queue_block_timeout = float(os.getenv('QUEUE_BLOCK_TIMEOUT', 2.0))
+        self.blocked_chats = Counter()  # Chats with messages waiting for room in a lane
+        
+        # Album parts (same grouped_id) are collected for this many seconds and sent together
+        self.album_window = float(os.getenv('ALBUM_WINDOW', 0.5))
+        self.album_buffers = {}  # chat_id -> album being collected
+        self.album_tasks = set()
+        
+        # Digest mode: rules with filters['digest'] buffer text and send it combined
+        self.digests = {}                # rule id -> open digest buffer
+        self.digest_tasks = set()
+        self.digest_flushes = {}         # rule id -> latest task sending one of its digests
+        self.digest_holds = Counter()    # Journal keys still waiting in an open digest
+        self.deferred_acks = set()       # Processed keys to acknowledge once their digests are sent
+        self.digest_failed = set()       # Keys whose digest could not be sent
+        self.digest_stats = Counter()    # digests, chunks, messages, failures
+        # Sends are started from a timer heap; MAX_CONCURRENT_FORWARDS bounds those in flight
+        self.send_scheduler = SendScheduler(self.max_concurrent_forwards)
+        self.dispatch_window = int(os.getenv('DISPATCH_WINDOW', 20))  # Messages per worker awaiting sends
+        self.dispatch_tasks = set()
+        self.target_latencies = {}  # target key -> recent receive-to-sent latencies
+        
+        # Native forward mode (filters['forward_mode'] == 'native'): messages are collected per
+        # (source, target) and sent with one forward_messages call
+        self.forward_batch_window = float(os.getenv('FORWARD_BATCH_WINDOW', 1.0))
+        self.forward_batches = {}  # (source chat, target key) -> open batch
+        self.batch_tasks = set()
+        self.forward_stats = Counter()  # batches, messages, requests_saved, fallbacks
         self.workers_running = False
+        self.supervisor = TaskSupervisor()  # Owns the worker and journal tasks
+        self.active_workers = set()         # Workers currently processing a message
+        # Seconds stop_forwarding waits in total for in-flight messages, digests and batches
+        # before cancelling them
+        self.stop_drain_timeout = min(float(os.getenv('STOP_DRAIN_TIMEOUT', 10)),
+                                      STOP_TIMEOUT_MAX - JOURNAL_STOP_RESERVE)
+        
+        # Durable ingest journal: every received message is written to the
+        # ingest_queue table in batches and deleted once it has been forwarded
+        self.journal_flush_interval = float(os.getenv('INGEST_FLUSH_INTERVAL', 0.05))
+        self.journal_batch_size = 100
+        self.journal_writes = []       # (chat_id, message_id) waiting to be written
+        self.journal_acks = []         # (chat_id, message_id) waiting to be deleted
+        self.journal_keys = set()      # Journaled entries currently held in memory
+        self.journal_event = asyncio.Event()
+        self.journal_lock = asyncio.Lock()
+        self.spill_event = asyncio.Event()
+        self.spilled_chats = set()     # Chats with messages waiting on disk
+        self.spilled_pending = 0
+        self.spill_count = 0
+        self.replay_after_id = 0
+        
+        # Catch-up: on start, messages each source received since its last
+        # checkpoint (the highest journaled message id) are fetched and queued
+        self.catchup_enabled = os.getenv('CATCHUP_ENABLED', 'true').lower() == 'true'
+        self.catchup_concurrency = int(os.getenv('CATCHUP_CONCURRENCY', 4))
+        self.catchup_max_messages = int(os.getenv('CATCHUP_MAX_MESSAGES', 500))
+        # Missed messages older than this many seconds are not replayed (0 replays any age)
+        self.catchup_max_age = float(os.getenv('CATCHUP_MAX_AGE', 3600))
+        self.checkpoints = {}          # chat_id -> last journaled message id
+        self.checkpoint_pending = {}   # Checkpoints written with the next journal flush
+        self.catching_up = {}          # chat_id -> live message ids received during its catch-up
+        self.catchup_stats = Counter()
         
         # Authentication state
         self.auth_state = 'none'  # none, code_sent, waiting_password, authenticated
@@ -78,10 +185,59 @@ class SimpleTelegramClient:
         
         # Initialize client with anti-detection parameters
         self.client = None
-        self.forwarding_rules = []
+        self.rules_snapshot = RuleSnapshot()  # Swapped atomically on every rule change
+        self.next_rule_id = 1
+        self.keyword_matcher = SharedKeywordMatcher()  # Keyword filters of all rules
         self.is_running = False
         self.is_authenticated = False
         
+        # Unresolved rule sources are retried at most this often from the message path; the
+        # route-retrier task retries them in the background, backing off up to the same interval
+        self.route_retry_interval = timedelta(minutes=1)
+        self.route_retry_base = float(os.getenv('ROUTE_RETRY_BASE', 5))
+        self.last_route_retry = None
+        self.handler_chats = None  # Chat IDs the NewMessage handler is registered for
+        
+        # Entity resolution cache: normalized username -> marked peer ID
+        self.entity_cache_ttl = int(os.getenv('ENTITY_CACHE_TTL', 86400))
+        self.entity_cache = TTLCache(max_size=5000, ttl=self.entity_cache_ttl)
+        self.db = DatabaseManager()
+        
+        # Duplicate suppression (off by default): content fingerprints sent to each target within dedup_window seconds
+        self.dedup_window = int(os.getenv('DEDUP_WINDOW', 0))
+        self.dedup_max_per_target = int(os.getenv('DEDUP_MAX_PER_TARGET', 5000))
+        self.dedup_caches = {}  # normalized target -> TTLCache of fingerprints
+        
+        # Delivery ledger: (source chat, message id, rule) -> sent message id, written with
+        # the journal so replayed messages are not delivered twice
+        self.ledger_retention = int(os.getenv('LEDGER_RETENTION', 7 * 86400))
+        self.ledger_writes = []  # Rows waiting for the next journal flush
+        self.recent_deliveries = TTLCache(max_size=20000, ttl=3600)
+        self.ledger_skips = 0
+        
+        # Media reuse: source photo/document -> media of an earlier send of it, so other
+        # targets (and later duplicates) reuse that upload instead of sending it again
+        self.media_cache = TTLCache(
+            max_size=int(os.getenv('MEDIA_CACHE_SIZE', 500)),
+            ttl=int(os.getenv('MEDIA_CACHE_TTL', 3600))
+        )
+        self.media_uploads = {}  # media key -> future resolved when its first scheduled send is done
+        
+        # Flood waits park the affected target (or the account) and its sends are rescheduled
+        self.flood_gate = FloodGate()
+        self.flood_waiting = []   # (ready_at, message_data) in the order they were rescheduled
+        self.flood_event = asyncio.Event()
+        self.flood_tasks = set()  # Digests waiting out a flood wait
+        
+        # Sends failing on network or server errors are rescheduled with backoff, up to
+        # RETRY_MAX_ATTEMPTS times per rule (filters['max_retries']); other failures, and
+        # retries that run out, go to the dead_letters table for a later re-drive
+        self.retry_max_attempts = int(os.getenv('RETRY_MAX_ATTEMPTS', 3))
+        self.retry_base_delay = float(os.getenv('RETRY_BASE_DELAY', 2.0))
+        self.retry_max_delay = float(os.getenv('RETRY_MAX_DELAY', 300.0))
+        self.redrive_rate = float(os.getenv('REDRIVE_RATE', 30))  # Dead letters re-queued per minute
+        self.retry_stats = Counter()  # retried, dead_lettered, redriven, discarded
+        
         # Ban protection
         self.consecutive_errors = 0
         self.max_consecutive_errors = 3
@@ -94,8 +250,35 @@ class SimpleTelegramClient:
         # Log instant forwarding settings after logger is initialized
         rate_limit = 60 if self.instant_mode else self.max_messages_per_minute
         self.logger.info(f"🚀 Instant Forwarding Mode: {'ENABLED' if self.instant_mode else 'DISABLED'}")
-        self.logger.info(f"📊 Rate Limit: {rate_limit} messages/minute")
+        self.logger.info(f"📊 Rate Limit: {self.rate_limiter.account.rate * 60:g} messages/minute, "
+                         f"{self.rate_limiter.target_rate:g} per target")
         self.logger.info(f"⏱️  Delay Between Forwards: {self.delay_between_forwards}s")
+        
+        self._load_entity_cache()
+        self.apply_rate_settings(self.db.get_settings())
+
+    def apply_rate_settings(self, settings):
+        """Apply rate limit values from the settings table; returns the ones applied"""
+        applied = {}
+        for key, (option, cast) in RATE_SETTINGS.items():
+            if settings.get(key) in (None, ''):
+                continue
+            try:
+                value = cast(settings[key])
+                if value <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                self.logger.warning(f"Ignoring invalid setting {key}={settings[key]!r}")
+                continue
+            applied[option] = value
+        if applied:
+            self.rate_limiter.configure(**applied)
+            self.logger.info(f"Rate limits updated: {applied}")
+        return applied
+
+    async def update_rate_settings(self, settings):
+        """apply_rate_settings on the client's event loop, where the buckets are used"""
+        return {'success': True, 'applied': self.apply_rate_settings(settings)}
 
     async def restore_session(self):
         """Restore existing Telegram session if available"""
@@ -460,51 +643,341 @@ class SimpleTelegramClient:
             self.logger.error(f"Error getting stats: {e}")
             return {'success': False, 'message': str(e)}
 
-    async def add_forwarding_rule(self, source, target, filters=None, db_id=None):
-        """Add a new forwarding rule"""
-        # Check if rule already exists to avoid duplicates
-        existing_rule = None
-        for rule in self.forwarding_rules:
-            # Check by database ID first, then by source+target combination
+    @property
+    def forwarding_rules(self):
+        """Rules of the current snapshot (read-only view)"""
+        return list(self.rules_snapshot.rules.values())
+
+    def _find_rule(self, source, target, db_id=None):
+        """Find an existing rule by database ID, then by source+target"""
+        for rule in self.rules_snapshot.rules.values():
             if (db_id and rule.get('db_id') == db_id) or (rule['source'] == source and rule['target'] == target):
-                existing_rule = rule
-                break
-        
+                return rule
+        return None
+
+    async def _prepare_rule(self, source, target, filters, db_id, existing_rule=None, priority=0):
+        """Build a new rule dict (never mutating the snapshot's copy) with its source resolved"""
         if existing_rule:
-            # Update existing rule instead of creating duplicate
-            existing_rule['filters'] = filters or {}
-            existing_rule['db_id'] = db_id  # Update database ID if provided
-            self.logger.info(f"Updated existing rule: {source} -> {target}")
-            return {'success': True, 'rule': existing_rule}
+            # Edited rules re-resolve their usernames
+            if (existing_rule['source'], existing_rule['target'], existing_rule['filters']) != (source, target, filters or {}):
+                self._invalidate_entity(existing_rule['source'])
+                self._invalidate_entity(existing_rule['target'])
+                self._invalidate_entity(source)
+                self._invalidate_entity(target)
+            rule = dict(existing_rule)
+        else:
+            rule = {
+                'id': self.next_rule_id,
+                'enabled': True,
+                'created_at': datetime.now(),
+                'message_count': 0
+            }
+            self.next_rule_id += 1
         
-        rule = {
-            'id': len(self.forwarding_rules) + 1,
+        rule.update({
             'db_id': db_id,  # Store database ID for proper removal
             'source': source,
             'target': target,
             'filters': filters or {},
-            'enabled': True,
-            'created_at': datetime.now(),
-            'message_count': 0
-        }
+            'priority': int(priority or 0)
+        })
         
-        self.forwarding_rules.append(rule)
-        self.logger.info(f"Added forwarding rule: {source} -> {target} (Total rules: {len(self.forwarding_rules)})")
+        if not existing_rule or existing_rule['source'] != source or existing_rule.get('source_chat_id') is None:
+            rule['source_chat_id'] = await self._resolve_peer_id(source)
+            if rule['source_chat_id'] is None:
+                self.logger.warning(f"Could not resolve source {source}, will retry later")
+        return rule
+
+    def _commit_rules(self, upserts=(), removals=()):
+        """Swap in a new rule snapshot with the given changes applied"""
+        upserts = list(upserts)
+        removals = list(removals)
+        for rule_id in removals:
+            self.keyword_matcher.remove_rule(rule_id)
+        for rule, _ in upserts:
+            filters = rule.get('filters') or {}
+            self.keyword_matcher.set_rule(rule['id'], filters.get('keywords'), filters.get('exclude_keywords'))
+        
+        self.rules_snapshot = self.rules_snapshot.evolve(upserts, removals)
+        self._register_message_handler()
+        self._spawn_route_retrier()
+        return self.rules_snapshot
+
+    async def add_forwarding_rule(self, source, target, filters=None, db_id=None, priority=0):
+        """Add a new forwarding rule"""
+        try:
+            predicate = compile_filters(filters)
+        except FilterError as e:
+            self.logger.error(f"Invalid filters for rule {source} -> {target}: {e}")
+            return {'success': False, 'message': str(e)}
+        
+        # Update existing rule instead of creating duplicate
+        existing_rule = self._find_rule(source, target, db_id)
+        rule = await self._prepare_rule(source, target, filters, db_id, existing_rule, priority)
+        snapshot = self._commit_rules(upserts=[(rule, predicate)])
+        
+        if existing_rule:
+            self.logger.info(f"Updated existing rule: {source} -> {target}")
+        else:
+            self.logger.info(f"Added forwarding rule: {source} -> {target} (Total rules: {len(snapshot)})")
         return {'success': True, 'rule': rule}
 
     async def remove_forwarding_rule(self, rule_id):
         """Remove a forwarding rule by rule_id"""
-        # Find and remove the rule with matching database ID
-        initial_count = len(self.forwarding_rules)
-        self.forwarding_rules = [r for r in self.forwarding_rules if r.get('db_id') != rule_id]
+        rules = self.rules_snapshot.rules.values()
+        # Find the rule with matching database ID, then by internal id
+        removed = [r['id'] for r in rules if r.get('db_id') == rule_id]
+        if not removed:
+            removed = [r['id'] for r in rules if r['id'] == rule_id]
         
-        # If no rule found by db_id, try by internal id
-        if len(self.forwarding_rules) == initial_count:
-            self.forwarding_rules = [r for r in self.forwarding_rules if r['id'] != rule_id]
+        self._commit_rules(removals=removed)
         
         self.logger.info(f"Removed forwarding rule {rule_id}")
         return {'success': True}
 
+    async def sync_rules(self, db_rules):
+        """Make the client's rules match the given database rules.
+
+        Only rules that were added, changed or removed are touched, and the
+        result is swapped in as one new snapshot.
+        """
+        desired = {rule['id']: rule for rule in db_rules}
+        current = {}
+        removals = []
+        for rule in self.rules_snapshot.rules.values():
+            if rule.get('db_id') in desired and rule['db_id'] not in current:
+                current[rule['db_id']] = rule
+            else:
+                removals.append(rule['id'])
+        
+        upserts = []
+        for db_id, db_rule in desired.items():
+            existing_rule = current.get(db_id)
+            filters = db_rule.get('filters') or {}
+            priority = db_rule.get('priority') or 0
+            if existing_rule and existing_rule.get('source_chat_id') is not None and \
+                    (existing_rule['source'], existing_rule['target'], existing_rule['filters'], existing_rule.get('priority', 0)) == \
+                    (db_rule['source'], db_rule['target'], filters, priority):
+                continue
+            try:
+                predicate = compile_filters(filters)
+            except FilterError as e:
+                self.logger.error(f"Skipping rule {db_id} with invalid filters: {e}")
+                if existing_rule:
+                    removals.append(existing_rule['id'])
+                continue
+            rule = await self._prepare_rule(db_rule['source'], db_rule['target'], filters, db_id, existing_rule, priority)
+            upserts.append((rule, predicate))
+        
+        if upserts or removals:
+            self._commit_rules(upserts, removals)
+        
+        self.logger.info(
+            f"Synced rules: {len(upserts)} added/updated, {len(removals)} removed "
+            f"(version {self.rules_snapshot.version}, total {len(self.rules_snapshot)})"
+        )
+        return {
+            'success': True,
+            'updated': len(upserts),
+            'removed': len(removals),
+            'version': self.rules_snapshot.version
+        }
+
+    @staticmethod
+    def _get_media_type(message):
+        """Classify a message for media_types filters"""
+        if not message.media:
+            return 'text'
+        for media_type in ('poll', 'contact', 'geo', 'sticker', 'gif', 'voice',
+                           'video_note', 'video', 'audio', 'photo', 'web_preview', 'document'):
+            if getattr(message, media_type, None):
+                return media_type
+        return 'other'
+
+    def _build_filter_context(self, message):
+        """Extract the values filter predicates look at, once per message"""
+        forwarded_from = None
+        fwd_from = getattr(message, 'fwd_from', None)
+        if fwd_from and getattr(fwd_from, 'from_id', None):
+            forwarded_from = utils.get_peer_id(fwd_from.from_id)
+        
+        return MessageContext(
+            text=message.text,
+            media_type=self._get_media_type(message),
+            sender_id=getattr(message, 'sender_id', None),
+            forwarded_from=forwarded_from
+        )
+
+    def get_filter_stats(self):
+        """Get per-predicate evaluation counters, most expensive first"""
+        stats = []
+        for rule_id, predicate in self.rules_snapshot.predicates.items():
+            for entry in predicate.get_stats():
+                stats.append({'rule_id': rule_id, **entry})
+        stats.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return stats
+
+    def _load_entity_cache(self):
+        """Warm the entity cache from the database"""
+        for row in self.db.get_cached_entities(self.entity_cache_ttl):
+            remaining = self.entity_cache_ttl - row['age']
+            if remaining > 0:
+                self.entity_cache.set(row['username'], row['peer_id'], ttl=remaining)
+        if len(self.entity_cache):
+            self.logger.info(f"Loaded {len(self.entity_cache)} cached entity resolutions")
+
+    @staticmethod
+    def _normalize_username(ref):
+        """Normalize @username / username to a cache key"""
+        return ref.strip().lstrip('@').lower()
+
+    def _invalidate_entity(self, ref):
+        """Drop a cached username resolution (e.g. when a rule is edited)"""
+        if not ref:
+            return
+        try:
+            int(ref)
+            return  # Chat IDs are never cached
+        except ValueError:
+            pass
+        key = self._normalize_username(ref)
+        self.entity_cache.pop(key)
+        self.db.delete_cached_entity(key)
+
+    async def _resolve_peer_id(self, ref, strict=False):
+        """Resolve a rule source/target (@username, username or chat ID) to a marked peer ID.
+
+        Returns None when it can't be resolved. With ``strict`` (send paths),
+        flood waits and transient errors are raised instead, so the caller
+        parks the account or retries the send.
+        """
+        try:
+            # Direct chat ID
+            return int(ref)
+        except ValueError:
+            pass
+        
+        key = self._normalize_username(ref)
+        peer_id = self.entity_cache.get(key)
+        if peer_id is not None:
+            return peer_id
+        
+        if not self.client:
+            return None
+        
+        try:
+            entity = await self.client.get_entity(f"@{key}")
+            # Marked ID: -100... for channels/supergroups, negative for groups
+            peer_id = utils.get_peer_id(entity)
+        except Exception as e:
+            if strict and (isinstance(e, FLOOD_ERRORS) or is_transient(e)):
+                raise
+            self.logger.error(f"Failed to get entity for {ref}: {e}")
+            return None
+        
+        self.entity_cache.set(key, peer_id)
+        self.db.save_cached_entity(key, peer_id)
+        return peer_id
+
+    async def _get_target_entity(self, target):
+        """Get the entity to send to, using the cached resolution when possible"""
+        peer_id = await self._resolve_peer_id(target, strict=True)
+        if peer_id is None:
+            raise ValueError(f"Could not resolve target {target}")
+        
+        try:
+            int(target)
+            return peer_id
+        except ValueError:
+            pass
+        
+        try:
+            # Served from the session's entity table, no network round trip
+            return await self.client.get_input_entity(peer_id)
+        except ValueError:
+            # Session lost the access hash; resolve the username again
+            self._invalidate_entity(target)
+            return await self.client.get_entity(f"@{self._normalize_username(target)}")
+
+    async def _retry_unrouted_rules(self, force=False):
+        """Retry resolving sources that failed to resolve, at most once per route_retry_interval
+        unless ``force``. Returns the flood wait (seconds) resolving ran into, or 0.
+        """
+        now = datetime.now()
+        if not force and self.last_route_retry and now - self.last_route_retry < self.route_retry_interval:
+            return 0
+        self.last_route_retry = now
+        
+        upserts = []
+        wait = 0
+        for rule in list(self.rules_snapshot.unrouted.values()):
+            try:
+                chat_id = await self._resolve_peer_id(rule['source'], strict=True)
+            except FLOOD_ERRORS as e:
+                # Further lookups would hit the same wait
+                wait = getattr(e, 'seconds', 0) or 0
+                self.logger.warning(f"Flood wait of {wait}s resolving {rule['source']}; unresolved sources are retried after it")
+                break
+            except Exception as e:
+                self.logger.error(f"Failed to get entity for {rule['source']}: {e}")
+                continue
+            if chat_id is not None:
+                upserts.append(({**rule, 'source_chat_id': chat_id}, self.rules_snapshot.predicates.get(rule['id'])))
+        
+        if upserts:
+            # Re-registers the NewMessage handler with the new sources
+            self._commit_rules(upserts)
+        return wait
+
+    def _spawn_route_retrier(self):
+        if self.is_running and self.rules_snapshot.unrouted:
+            self.supervisor.spawn('route-retrier', self._route_retrier)
+
+    async def _route_retrier(self):
+        """Resolve unrouted rule sources in the background until all are routed, backing off
+        between attempts (and waiting out flood waits) so a failure at start doesn't leave a
+        source unheard until the next restart
+        """
+        attempt = 0
+        wait = 0
+        while self.is_running and self.rules_snapshot.unrouted:
+            attempt += 1
+            cap = self.route_retry_interval.total_seconds()
+            await asyncio.sleep(max(wait, backoff_delay(attempt, base=self.route_retry_base, cap=cap)))
+            wait = await self._retry_unrouted_rules(force=True)
+
+    def _get_source_chat_ids(self):
+        """Chat IDs the NewMessage handler should listen to"""
+        chat_ids = set()
+        for rules in self.rules_snapshot.routes.values():
+            for rule in rules:
+                try:
+                    # Bare IDs keep the legacy abs() match: Telethon expands a
+                    # positive ID to the user, group and channel with that ID
+                    chat_ids.add(abs(int(rule['source'])))
+                except ValueError:
+                    chat_ids.add(rule['source_chat_id'])
+        return frozenset(chat_ids)
+
+    def _register_message_handler(self):
+        """(Re-)register the NewMessage handler for the current rule sources only"""
+        if not self.client or not self.is_running:
+            return
+        
+        chat_ids = self._get_source_chat_ids()
+        if chat_ids == self.handler_chats:
+            return
+        
+        self.client.remove_event_handler(self._on_new_message)
+        self.handler_chats = chat_ids
+        if chat_ids:
+            self.client.add_event_handler(self._on_new_message, events.NewMessage(chats=list(chat_ids)))
+        self.logger.info(f"Listening for new messages in {len(chat_ids)} source chats")
+
+    async def _on_new_message(self, event):
+        """NewMessage handler, only called for chats that have rules"""
+        await self._queue_message(event)
+
     async def get_forwarding_rules(self):
         """Get all forwarding rules"""
         return {'success': True, 'rules': self.forwarding_rules}
@@ -517,89 +990,725 @@ class SimpleTelegramClient:
         self.is_running = True
         
         # Start worker tasks for concurrent processing
-        if not self.workers_running:
+        starting = not self.workers_running
+        if starting:
             self.workers_running = True
-            for i in range(self.max_concurrent_forwards):
-                asyncio.create_task(self._message_worker(f"worker-{i}"))
+            
+            # Replay journal entries left unacknowledged by a previous run
+            self.journal_keys = set()
+            self.replay_after_id = 0
+            self.spilled_chats.clear()
+            self.spill_event.clear()
+            self.journal_event.clear()
+            self.spilled_pending = await asyncio.to_thread(self.db.count_pending_ingest_entries)
+            if self.spilled_pending:
+                self.logger.info(f"Replaying {self.spilled_pending} unacknowledged messages from the ingest journal")
+                self.spill_event.set()
+            
+            # Mark sources for catch-up before any handler is registered, so live
+            # messages can't move a checkpoint past the gap
+            self.checkpoints = await asyncio.to_thread(self.db.get_source_checkpoints)
+            self.checkpoint_pending = {}
+            if self.catchup_enabled:
+                self.catching_up = {chat_id: set() for chat_id in self._catch_up_chats()}
+        
+        # One worker per lane; spawning is a no-op for tasks that are already running
+        for i in range(self.message_queue.shards):
+            self.supervisor.spawn(f"worker-{i}", lambda i=i: self._message_worker(f"worker-{i}", i))
+        self.supervisor.spawn('journal-flusher', self._journal_flusher)
+        self.supervisor.spawn('journal-replayer', self._journal_replayer)
+        self.supervisor.spawn('ledger-pruner', self._ledger_pruner)
+        self.supervisor.spawn('flood-requeuer', self._flood_requeuer)
+        self.supervisor.spawn('send-scheduler', self.send_scheduler.run)
         
-        # Set up event handler for new messages
-        @self.client.on(events.NewMessage)
-        async def handle_new_message(event):
-            await self._queue_message(event)
+        # Listen only to chats that have rules
+        if self.rules_snapshot.unrouted:
+            self.last_route_retry = None
+            await self._retry_unrouted_rules()
+            self._spawn_route_retrier()
+        
+        # Catch up every routed source, including ones resolved just now
+        if starting and self.catchup_enabled:
+            for chat_id in self._catch_up_chats():
+                self.catching_up.setdefault(chat_id, set())
+            catch_up_chats = list(self.catching_up)
+            if catch_up_chats:
+                self.supervisor.spawn('catch-up', lambda: self._catch_up(catch_up_chats))
+        
+        self.handler_chats = None
+        self._register_message_handler()
         
         self.logger.info(f"Started forwarding with {self.max_concurrent_forwards} concurrent workers")
         return {'success': True, 'message': 'Forwarding started'}
 
     async def stop_forwarding(self):
-        """Stop the forwarding process"""
+        """Stop the forwarding process.
+
+        In-flight messages, digests and forward batches share one budget of
+        stop_drain_timeout seconds and are cancelled after that; anything not
+        acknowledged stays in the ingest journal and is replayed on the next
+        start.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.stop_drain_timeout
+        
+        def remaining():
+            return max(0.0, deadline - loop.time())
+        
         self.is_running = False
         self.workers_running = False
+        if self.client:
+            self.client.remove_event_handler(self._on_new_message)
+        self.handler_chats = None
+        await self.supervisor.stop(['catch-up', 'dead-letter-redrive', 'route-retrier'],
+                                   cancel=['catch-up', 'dead-letter-redrive', 'route-retrier'])
+        
+        # Idle workers are blocked on their lane and can go at once
+        workers = self.supervisor.running('worker-')
+        idle = [name for name in workers if name not in self.active_workers]
+        finished, cancelled = await self.supervisor.stop(workers, timeout=remaining(), cancel=idle)
+        if cancelled > len(idle):
+            self.logger.warning(f"Cancelled {cancelled - len(idle)} in-flight messages after {self.stop_drain_timeout}s")
+        
+        # Send buffered digests and forward batches so their messages can be acknowledged
+        await self._flush_all_digests(timeout=remaining())
+        await self._flush_all_forward_batches(timeout=remaining())
+        
+        # Scheduled sends get what is left of the budget; the rest stay in the journal
+        if self.dispatch_tasks:
+            _, pending = await asyncio.wait(list(self.dispatch_tasks), timeout=remaining())
+            if pending:
+                self.logger.warning(f"Cancelled {len(pending)} messages with sends still scheduled after {self.stop_drain_timeout}s")
+        for task in list(self.batch_tasks):
+            task.cancel()
+        await self.send_scheduler.clear()
+        if self.dispatch_tasks:
+            await asyncio.wait(list(self.dispatch_tasks))
+        await self.supervisor.stop(['send-scheduler'], cancel=['send-scheduler'])
+        
+        # Sends waiting out a flood wait stay unacknowledged in the journal
+        await self.supervisor.stop(['flood-requeuer'], cancel=['flood-requeuer'])
+        self.flood_waiting = []
+        for task in list(self.flood_tasks):
+            task.cancel()
+        if self.flood_tasks:
+            await asyncio.wait(list(self.flood_tasks))
+        self.digest_holds.clear()
+        self.deferred_acks.clear()
+        
+        # Queued messages and open albums are still in the journal; drop them from memory
+        # so a restart doesn't send them twice
+        self.album_buffers.clear()
+        left = self.message_queue.clear()
+        if left:
+            self.logger.info(f"{left} queued messages left in the ingest journal for the next start")
+        
+        # Wake the journal tasks so they flush and exit
+        self.journal_event.set()
+        self.spill_event.set()
+        await self.supervisor.stop(['journal-flusher', 'journal-replayer', 'ledger-pruner'],
+                                   timeout=remaining() + JOURNAL_STOP_RESERVE, cancel=['ledger-pruner'])
+        
         self.logger.info("Stopped forwarding")
         return {'success': True, 'message': 'Forwarding stopped'}
     
     async def _queue_message(self, event):
-        """Queue incoming messages for processing"""
+        """Journal incoming messages and queue them for processing"""
         if not self.is_running:
             return
-            
+        
+        chat_id = event.chat_id
+        self._journal_append((chat_id, event.message.id))
+        if chat_id in self.catching_up:
+            # The checkpoint moves past live messages once the gap before them is fetched
+            self.catching_up[chat_id].add(event.message.id)
+        else:
+            self._advance_checkpoint(chat_id, event.message.id)
+        await self._ingest_message(chat_id, event.message)
+
+    async def _ingest_message(self, chat_id, message):
+        """Queue a journaled message, collecting album parts first"""
+        buffer = self.album_buffers.get(chat_id)
+        if buffer:
+            if message.grouped_id == buffer['grouped_id']:
+                buffer['messages'].append(message)
+                buffer['flush_at'] = asyncio.get_running_loop().time() + self.album_window
+            else:
+                # Keep per-chat order: later messages wait until the album is queued
+                buffer['held'].append(message)
+            return
+        
+        if getattr(message, 'grouped_id', None) and self.album_window > 0:
+            # Album parts arrive as separate events; collect them for album_window seconds
+            self.album_buffers[chat_id] = {
+                'grouped_id': message.grouped_id,
+                'messages': [message],
+                'held': [],
+                'flush_at': asyncio.get_running_loop().time() + self.album_window
+            }
+            task = asyncio.create_task(self._album_timer(chat_id))
+            self.album_tasks.add(task)
+            task.add_done_callback(self.album_tasks.discard)
+            return
+        
+        await self._enqueue_messages(chat_id, [message])
+
+    async def _album_timer(self, chat_id):
+        """Queue a collected album once no part has arrived for album_window seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            buffer = self.album_buffers.get(chat_id)
+            if buffer is None or not self.is_running:
+                return  # Stopped; the parts are still in the journal
+            delay = buffer['flush_at'] - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        
+        del self.album_buffers[chat_id]
+        await self._enqueue_messages(chat_id, buffer['messages'])
+        for message in buffer['held']:
+            await self._ingest_message(chat_id, message)
+
+    async def _enqueue_messages(self, chat_id, messages):
+        """Match and queue one message, or one album given as all its parts"""
+        keys = [(chat_id, message.id) for message in messages]
+        
+        # Keep per-chat order: once a chat has spilled, later messages follow it to disk
+        if chat_id in self.spilled_chats:
+            for _ in keys:
+                self._spill(chat_id)
+            return
+        
+        # Match once here so the message can be queued at the priority of its rules
+        message_data = await self._build_message_data(messages, chat_id)
+        if message_data is None:
+            for key in keys:
+                self._journal_ack(key)
+            return
         try:
-            # Add message to queue, drop if queue is full (backpressure)
-            self.message_queue.put_nowait({
-                'event': event,
-                'timestamp': datetime.now(),
-                'message_id': event.message.id,
-                'chat_id': event.chat_id
-            })
-            
-            # In instant mode, immediately wake up workers for faster processing
-            if self.instant_mode:
-                await asyncio.sleep(0)  # Yield control to allow immediate worker processing
-                
-            self.logger.debug(f"Queued message {event.message.id} from chat {event.chat_id}")
+            if self.blocked_chats[chat_id]:
+                # Earlier messages from this chat are waiting for room; queue behind them
+                raise asyncio.QueueFull
+            # Add message to its chat's lane
+            self._enqueue(message_data)
         except asyncio.QueueFull:
-            self.logger.warning("Message queue full, dropping message")
-    
-    async def _message_worker(self, worker_name: str):
-        """Worker task to process messages from the queue"""
-        self.logger.info(f"Started message worker: {worker_name}")
+            if not await self._handle_overflow(chat_id, message_data):
+                return
+        self.journal_keys.update(keys)
+        
+        # In instant mode, immediately wake up workers for faster processing
+        if self.instant_mode:
+            await asyncio.sleep(0)  # Yield control to allow immediate worker processing
+            
+        self.logger.debug(f"Queued message {message_data['message_id']} ({len(messages)} parts) from chat {chat_id}")
+
+    async def _build_message_data(self, messages, chat_id, rules=None):
+        """Match a message (or album) against the rules once; returns its queue item, or None if no rule matched"""
+        # An album is matched on the part carrying the caption
+        message = next((m for m in messages if m.text), messages[0])
+        
+        if rules is None:
+            # Retry rules whose source could not be resolved yet
+            if self.rules_snapshot.unrouted:
+                await self._retry_unrouted_rules()
+            rules = await self._match_rules(message, chat_id)
+        if not rules:
+            self.logger.debug(f"No rules matched for message {message.id} from {chat_id}")
+            return None
         
+        # Earliest deadline among rules with a max_age orders the queue
+        sent_at = self._message_sent_at(message)
+        max_ages = [float(rule['filters']['max_age']) for rule in rules if rule['filters'].get('max_age')]
+        return {
+            'message': message,
+            'timestamp': datetime.now(),
+            'message_id': message.id,
+            'message_ids': [m.id for m in messages],
+            'album': messages if len(messages) > 1 else None,
+            'chat_id': chat_id,
+            'rules': rules,
+            'priority': max(rule.get('priority', 0) for rule in rules),
+            'sent_at': sent_at,
+            'deadline': sent_at + min(max_ages) if max_ages else None,
+            'replayed': False,
+            'retain': False,  # Keep in the journal even if later sends succeed
+            'attempts': {}    # Ledger rule id -> transient failures retried so far
+        }
+
+    @staticmethod
+    def _message_sent_at(message):
+        """Unix time a message was sent, falling back to now"""
+        date = getattr(message, 'date', None)
+        if isinstance(date, datetime):
+            return date.timestamp()
+        return time.time()
+
+    @staticmethod
+    def _journal_keys_of(message_data):
+        """Journal keys of every message in a queue item"""
+        return [(message_data['chat_id'], message_id) for message_id in message_data['message_ids']]
+
+    def _enqueue(self, message_data):
+        """Put a message on its chat's lane; raises asyncio.QueueFull if the lane is full"""
+        return self.message_queue.put_nowait(
+            message_data['chat_id'], message_data, message_data['priority'], message_data['deadline']
+        )
+
+    def _overflow_policy_for(self, chat_id):
+        """Overflow policy for a chat: the most conservative one its rules set, else QUEUE_OVERFLOW_POLICY"""
+        rules = self.rules_snapshot.routes.get(abs(chat_id), ())
+        return resolve_overflow_policy(
+            [(rule.get('filters') or {}).get('overflow_policy') for rule in rules], self.overflow_policy
+        )
+
+    async def _handle_overflow(self, chat_id, message_data):
+        """Apply the overflow policy to a message whose lane is full; True if it was queued"""
+        policy = self._overflow_policy_for(chat_id)
+        
+        if policy == 'block':
+            self.blocked_chats[chat_id] += 1
+            try:
+                await self.message_queue.put(
+                    chat_id, message_data, message_data['priority'], message_data['deadline'],
+                    timeout=self.queue_block_timeout
+                )
+                return True
+            except asyncio.QueueFull:
+                # Waited long enough; keep the message on disk instead
+                policy = 'spill'
+            finally:
+                self.blocked_chats[chat_id] -= 1
+                if self.blocked_chats[chat_id] <= 0:
+                    del self.blocked_chats[chat_id]
+        
+        if policy in ('coalesce', 'drop_oldest'):
+            # Make room by discarding an older queued message
+            dropped = None
+            if policy == 'coalesce':
+                dropped = self.message_queue.drop_oldest_for_key(chat_id)
+            if dropped is None:
+                dropped = self.message_queue.drop_oldest(chat_id)
+            if dropped is not None:
+                for key in self._journal_keys_of(dropped):
+                    self._journal_ack(key)
+                self._enqueue(message_data)
+                self.logger.debug(f"Lane for chat {chat_id} full, dropped queued message {dropped['message_id']} ({policy})")
+                return True
+            policy = 'drop_newest'
+        
+        if policy == 'drop_newest':
+            self.message_queue.record('dropped_newest')
+            for key in self._journal_keys_of(message_data):
+                self._journal_ack(key)
+            self.logger.debug(f"Lane for chat {chat_id} full, dropped message {message_data['message_id']}")
+            return False
+        
+        # Spill: the message stays in the journal and is replayed when there is room
+        for _ in message_data['message_ids']:
+            self._spill(chat_id)
+        self.logger.debug(f"Lane for chat {chat_id} full, spilled message {message_data['message_id']} to disk")
+        return False
+
+    def _spill(self, chat_id):
+        """Leave a journaled message on disk for the replayer"""
+        self.spilled_chats.add(chat_id)
+        self.message_queue.record('spilled')
+        self.spilled_pending += 1
+        self.spill_count += 1
+        self.spill_event.set()
+
+    def _journal_append(self, key):
+        """Buffer a journal write; flushed in batches by the journal flusher"""
+        self.journal_writes.append(key)
+        if len(self.journal_writes) >= self.journal_batch_size:
+            self.journal_event.set()
+
+    def _advance_checkpoint(self, chat_id, message_id):
+        """Record the newest journaled message of a chat; written with the next journal flush"""
+        if message_id > self.checkpoints.get(chat_id, 0):
+            self.checkpoints[chat_id] = message_id
+            self.checkpoint_pending[chat_id] = message_id
+
+    def _journal_ack(self, key):
+        """Buffer an acknowledgement for a processed message"""
+        self.journal_acks.append(key)
+        self.journal_keys.discard(key)
+        if len(self.journal_acks) >= self.journal_batch_size:
+            self.journal_event.set()
+
+    async def _flush_journal(self):
+        """Write buffered journal entries and acknowledgements"""
+        async with self.journal_lock:
+            await self._write_journal()
+
+    async def _write_journal(self):
+        """Write buffered entries and acks in one transaction each (journal_lock must be held)"""
+        writes, self.journal_writes = self.journal_writes, []
+        acks, self.journal_acks = self.journal_acks, []
+        checkpoints, self.checkpoint_pending = self.checkpoint_pending, {}
+        deliveries, self.ledger_writes = self.ledger_writes, []
+        
+        # Entries acknowledged before they were written never need to touch the disk
+        if writes and acks:
+            acked = set(acks)
+            written = set(writes)
+            writes = [key for key in writes if key not in acked]
+            acks = [key for key in acks if key not in written]
+        
+        try:
+            if writes:
+                await asyncio.to_thread(self.db.append_ingest_entries, writes)
+                writes = []
+            # Checkpoints only after the entries they cover are on disk
+            if checkpoints:
+                await asyncio.to_thread(self.db.save_source_checkpoints, checkpoints)
+                checkpoints = {}
+            # Deliveries before acks: an acknowledged message always has its ledger rows
+            if deliveries:
+                await asyncio.to_thread(self.db.record_deliveries, deliveries)
+                deliveries = []
+            if acks:
+                await asyncio.to_thread(self.db.ack_ingest_entries, acks)
+        except Exception as e:
+            self.logger.error(f"Failed to flush ingest journal: {e}")
+            # Keep the entries for the next flush
+            self.journal_writes = writes + self.journal_writes
+            self.journal_acks = acks + self.journal_acks
+            self.ledger_writes = deliveries + self.ledger_writes
+            for chat_id, message_id in checkpoints.items():
+                if message_id > self.checkpoint_pending.get(chat_id, 0):
+                    self.checkpoint_pending[chat_id] = message_id
+
+    async def _journal_flusher(self):
+        """Flush the ingest journal every journal_flush_interval or when a batch fills up"""
         while self.workers_running:
             try:
-                # Get message from queue with timeout
-                try:
-                    message_data = await asyncio.wait_for(
-                        self.message_queue.get(), 
-                        timeout=1.0
+                await asyncio.wait_for(self.journal_event.wait(), timeout=self.journal_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.journal_event.clear()
+            await self._flush_journal()
+        
+        await self._flush_journal()
+
+    async def _journal_replayer(self):
+        """Feed spilled and unacknowledged journal entries back into the lanes, oldest first"""
+        while self.workers_running:
+            await self.spill_event.wait()
+            if not self.workers_running:
+                break
+            
+            try:
+                spill_count = self.spill_count
+                async with self.journal_lock:
+                    await self._write_journal()
+                    entries = await asyncio.to_thread(
+                        self.db.get_pending_ingest_entries, self.replay_after_id, 200
                     )
-                except asyncio.TimeoutError:
+                    # Skip entries held in memory or acknowledged since the write
+                    skip = self.journal_keys | set(self.journal_acks)
+                    entries = [e for e in entries if (e['chat_id'], e['message_id']) not in skip]
+                
+                if not entries:
+                    if spill_count == self.spill_count:
+                        # Everything on disk is either in memory or done
+                        self.spilled_pending = 0
+                        self.spilled_chats.clear()
+                        self.spill_event.clear()
                     continue
                 
-                # Process the message
-                await self._process_message_concurrent(message_data, worker_name)
+                if not await self._replay_entries(entries):
+                    # Lanes are full; give the workers time to drain
+                    await asyncio.sleep(0.5)
+                    
+            except Exception as e:
+                self.logger.error(f"Ingest journal replay error: {e}")
+                await asyncio.sleep(1.0)
+
+    async def _replay_entries(self, entries):
+        """Fetch and enqueue journal entries in id order; False when a lane is full"""
+        # Fetch each chat's messages in one request
+        ids_by_chat = {}
+        for entry in entries:
+            ids_by_chat.setdefault(entry['chat_id'], []).append(entry['message_id'])
+        
+        messages = {}
+        for chat_id, message_ids in ids_by_chat.items():
+            try:
+                fetched = await self.client.get_messages(chat_id, ids=message_ids)
+            except Exception as e:
+                self.logger.warning(f"Could not fetch journaled messages from {chat_id}: {e}")
+                fetched = [None] * len(message_ids)
+            for message_id, message in zip(message_ids, fetched):
+                messages[(chat_id, message_id)] = message
+        
+        # Consecutive parts of the same album are replayed as one item
+        groups = []
+        for entry in entries:
+            message = messages.get((entry['chat_id'], entry['message_id']))
+            grouped_id = getattr(message, 'grouped_id', None)
+            last = groups[-1] if groups else None
+            if grouped_id and last and last['chat_id'] == entry['chat_id'] and last['grouped_id'] == grouped_id:
+                last['entries'].append(entry)
+                last['messages'].append(message)
+            else:
+                groups.append({
+                    'chat_id': entry['chat_id'],
+                    'grouped_id': grouped_id,
+                    'entries': [entry],
+                    'messages': [message] if message is not None else []
+                })
+        
+        for group in groups:
+            keys = [(e['chat_id'], e['message_id']) for e in group['entries']]
+            message_data = None
+            if group['messages']:
+                message_data = await self._build_message_data(group['messages'], group['chat_id'])
+            
+            if message_data is None:
+                # Deleted, inaccessible or no longer matching; nothing to replay
+                for key in keys:
+                    self._journal_ack(key)
+            else:
+                # May have been delivered before a crash; checked against the ledger
+                message_data['replayed'] = True
+                try:
+                    self._enqueue(message_data)
+                except asyncio.QueueFull:
+                    return False
+                self.journal_keys.update(keys)
+            
+            self.replay_after_id = group['entries'][-1]['id']
+            self.spilled_pending = max(0, self.spilled_pending - len(keys))
+        
+        return True
+    
+    def _catch_up_chats(self):
+        """Chat ids to catch up: one per routed source, preferring the id its checkpoint uses"""
+        by_key = {abs(chat_id): chat_id for chat_id in self.checkpoints}
+        return [
+            by_key.get(key, rules[0]['source_chat_id'])
+            for key, rules in self.rules_snapshot.routes.items()
+        ]
+
+    async def _catch_up(self, chat_ids):
+        """Catch up every source, a few chats at a time"""
+        semaphore = asyncio.Semaphore(self.catchup_concurrency)
+        
+        async def run(chat_id):
+            async with semaphore:
+                await self._catch_up_chat(chat_id)
+        
+        self.logger.info(f"Catching up {len(chat_ids)} sources")
+        await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+        self.logger.info(
+            f"Catch-up finished: {self.catchup_stats['ingested']} missed messages queued "
+            f"from {len(chat_ids)} sources"
+        )
+
+    async def _catch_up_chat(self, chat_id):
+        """Fetch the messages a chat received after its checkpoint and queue them oldest first"""
+        try:
+            last_id = self.checkpoints.get(chat_id)
+            if last_id is None:
+                # New source: start from its newest message instead of backfilling history
+                latest = await self.client.get_messages(chat_id, limit=1)
+                if latest:
+                    self._advance_checkpoint(chat_id, latest[0].id)
+                return
+            
+            # Newest first so a very long gap keeps its most recent messages
+            live_ids = self.catching_up.get(chat_id, set())
+            cutoff = time.time() - self.catchup_max_age if self.catchup_max_age > 0 else None
+            missed = []
+            async for message in self.client.iter_messages(chat_id, min_id=last_id, limit=self.catchup_max_messages):
+                if cutoff is not None and self._message_sent_at(message) < cutoff:
+                    # Everything further back is older still; skip past it
+                    self.catchup_stats['too_old'] += 1
+                    self._advance_checkpoint(chat_id, message.id)
+                    break
+                if message.id not in live_ids and not getattr(message, 'action', None):
+                    missed.append(message)
+            self.catchup_stats['fetched'] += len(missed)
+            
+            for message in reversed(missed):
+                if not self.is_running:
+                    return
+                # Go no faster than the workers drain the chat's lane
+                await self.message_queue.wait_for_room(chat_id)
+                self._journal_append((chat_id, message.id))
+                self._advance_checkpoint(chat_id, message.id)
+                await self._ingest_message(chat_id, message)
+                self.catchup_stats['ingested'] += 1
                 
-                # Mark task as done
-                self.message_queue.task_done()
+        except Exception as e:
+            self.catchup_stats['failed_chats'] += 1
+            self.logger.warning(f"Could not catch up {chat_id}: {e}")
+        finally:
+            live_ids = self.catching_up.pop(chat_id, None)
+            if live_ids:
+                self._advance_checkpoint(chat_id, max(live_ids))
+
+    async def _message_worker(self, worker_name: str, shard: int):
+        """Worker task to process messages from its queue lane in order.
+        
+        The worker only matches a message and schedules its sends; waiting for
+        them happens in a completion task, up to dispatch_window per worker.
+        """
+        self.logger.info(f"Started message worker: {worker_name} (lane {shard})")
+        window = asyncio.Semaphore(self.dispatch_window)
+        
+        while self.workers_running:
+            # Block until there is room and the lane has work; stop_forwarding cancels idle workers
+            await window.acquire()
+            message_data = await self.message_queue.get(shard)
+            self.active_workers.add(worker_name)
+            try:
+                dispatch = await self._process_message_concurrent(message_data, worker_name)
+                task = asyncio.create_task(self._complete_message(message_data, dispatch, shard))
+                self.dispatch_tasks.add(task)
+                task.add_done_callback(self.dispatch_tasks.discard)
+                if len(dispatch['sends']) > dispatch['batched']:
+                    task.add_done_callback(lambda _: window.release())
+                else:
+                    # Only native forwards: they wait in their batch (bounded by FORWARD_BATCH_MAX
+                    # and batch_window), so holding a slot would cap batches at the window size
+                    window.release()
                 
             except Exception as e:
+                window.release()
                 self.logger.error(f"Worker {worker_name} error: {e}")
                 # Shorter pause in instant mode
                 pause_time = 0.2 if self.instant_mode else 1.0
                 await asyncio.sleep(pause_time)
+            finally:
+                self.active_workers.discard(worker_name)
         
         self.logger.info(f"Stopped message worker: {worker_name}")
     
+    async def _complete_message(self, message_data, dispatch, shard):
+        """Wait for a message's sends, then acknowledge or reschedule it"""
+        done = await self._finish_dispatch(dispatch)
+        if dispatch['parked'] or dispatch['retries']:
+            # Acknowledged once the rescheduled sends are done
+            self._reschedule(message_data, dispatch['parked'], done, dispatch['retries'])
+        elif done and not message_data['retain']:
+            for key in self._journal_keys_of(message_data):
+                self._ack_processed(key)
+        
+        # Mark task as done
+        latency = (datetime.now() - message_data['timestamp']).total_seconds()
+        self.message_queue.task_done(shard, message_data['priority'], latency)
+    
+    def _ack_processed(self, key):
+        """Acknowledge a processed message unless part of it still waits in a digest"""
+        if key in self.digest_holds:
+            self.deferred_acks.add(key)
+        elif key in self.digest_failed:
+            # Leave it in the journal so it is sent again on the next start
+            self.digest_failed.discard(key)
+        else:
+            self._journal_ack(key)
+
     async def _process_message_concurrent(self, message_data: dict, worker_name: str):
-        """Process a single message with concurrency control"""
-        async with self.semaphore:  # Limit concurrent processing
-            event = message_data['event']
+        """Dispatch a queued message; its sends run on the send scheduler"""
+        delivered = None
+        if message_data['replayed']:
+            delivered = await asyncio.to_thread(
+                self.db.get_delivered_rules, message_data['chat_id'], message_data['message_id']
+            )
+        return await self._dispatch_message(
+            message_data['message'], message_data['chat_id'], worker_name,
+            message_data['rules'], message_data['sent_at'], message_data['album'], delivered, [],
+            message_data['timestamp'].timestamp(), message_data['attempts']
+        )
+    
+    def _reschedule(self, message_data, rules, done=True, retries=()):
+        """Queue a message again for rules whose target is parked by a flood wait,
+        and for ``retries``, rules whose send failed transiently (after a backoff)"""
+        delays = [self.flood_gate.remaining(self._flood_key(rule['target'])) for rule in rules]
+        attempts = dict(message_data['attempts'])
+        for rule in retries:
+            rule_id = self._ledger_rule_id(rule)
+            attempts[rule_id] = attempts.get(rule_id, 0) + 1
+            delays.append(backoff_delay(attempts[rule_id], self.retry_base_delay, self.retry_max_delay))
+        delay = min(delays)
+        message_data = {
+            **message_data, 'rules': list(rules) + list(retries), 'attempts': attempts,
+            'retain': message_data['retain'] or not done
+        }
+        if rules:
+            self.flood_gate.record('rescheduled')
+        self.retry_stats['retried'] += len(retries)
+        self.logger.info(
+            f"Rescheduling message {message_data['message_id']} for {len(rules)} parked and "
+            f"{len(retries)} failed targets in {delay:.1f}s"
+        )
+        self.flood_waiting.append((time.monotonic() + delay, message_data))
+        self.flood_event.set()
+    
+    async def _flood_requeuer(self):
+        """Queue rescheduled messages again once their flood wait is over, in reschedule order"""
+        while self.workers_running:
+            now = time.monotonic()
+            ready = [entry for entry in self.flood_waiting if entry[0] <= now]
+            if ready:
+                self.flood_waiting = [entry for entry in self.flood_waiting if entry[0] > now]
+                for _, message_data in ready:
+                    await self.message_queue.put(
+                        message_data['chat_id'], message_data, message_data['priority'], message_data['deadline']
+                    )
+                continue
             
-            # Use the existing processing logic
-            await self._process_message_internal(event, worker_name)
+            timeout = min(entry[0] for entry in self.flood_waiting) - now if self.flood_waiting else None
+            self.flood_event.clear()
+            try:
+                await asyncio.wait_for(self.flood_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _flood_key(self, target):
+        return self._normalize_username(str(target))
     
-    async def _process_message_internal(self, event, worker_name: str = "main"):
-        """Internal message processing with worker identification"""
+    def _park_for_flood(self, key, error):
+        """Park a target (or the account, key ACCOUNT) for the wait Telegram asked for"""
+        seconds = getattr(error, 'seconds', 0) or 0
+        self.flood_gate.park(key, seconds)
+        self.logger.warning(f"Flood wait of {seconds}s for {'the account' if key is ACCOUNT else key}; pending sends are rescheduled")
+    
+    async def _process_message_internal(self, message, source_id, worker_name: str = "main", rules=None, sent_at=None,
+                                        album=None, delivered=None, parked=None):
+        """Internal message processing with worker identification.
+        
+        Returns True when the message is done with (forwarded, filtered or
+        skipped by limits) and False when it should be replayed later. If a
+        ``parked`` list is given, rules whose target is waiting out a flood
+        wait are added to it instead of counting as failures.
+        """
+        dispatch = await self._dispatch_message(message, source_id, worker_name, rules, sent_at, album, delivered, parked)
+        return await self._finish_dispatch(dispatch)
+
+    async def _dispatch_message(self, message, source_id, worker_name: str = "main", rules=None, sent_at=None,
+                                album=None, delivered=None, parked=None, received_at=None, attempts=None):
+        """Run a message's checks and schedule its sends without waiting for them.
+        
+        Sends to different targets run concurrently, each within its own
+        rate budget. Returns the dispatch state for _finish_dispatch;
+        ``done`` is False when the message should be replayed later. Sends
+        that fail transiently are only retried when ``parked`` is given
+        (the caller reschedules them); ``attempts`` counts earlier retries.
+        """
+        if received_at is None:
+            received_at = time.time()
+        dispatch = {
+            'message': message, 'album': album, 'source_id': source_id, 'worker_name': worker_name,
+            'sends': [], 'batched': 0, 'forwarded': 0, 'parked': parked, 'fingerprint': None, 'done': True,
+            'retries': [] if parked is not None else None, 'attempts': attempts or {}
+        }
         if not self.is_running:
-            return
+            dispatch['done'] = False
+            return dispatch
         
         try:
             # Reset daily count if needed (thread-safe)
@@ -610,133 +1719,547 @@ class SimpleTelegramClient:
             # Check daily limit
             if self.daily_forward_count >= self.max_daily_forwards:
                 self.logger.debug(f"{worker_name}: Daily limit reached ({self.daily_forward_count})")
-                return
+                return dispatch
             
             # Check ban protection
             if self._should_skip_due_to_errors():
                 self.logger.debug(f"{worker_name}: Skipping due to error cooldown")
-                return
-            
-            message = event.message
-            source_id = event.chat_id
+                return dispatch
             
             self.logger.debug(f"{worker_name}: Processing message {message.id} from {source_id}")
             
-            # Find matching forwarding rules
-            forwarded_count = 0
-            total_rules = len(self.forwarding_rules)
-            self.logger.debug(f"Processing message {message.id} against {total_rules} rules")
+            if rules is None:
+                # Retry rules whose source could not be resolved yet
+                if self.rules_snapshot.unrouted:
+                    await self._retry_unrouted_rules()
+                rules = await self._match_rules(message, source_id)
             
-            for i, rule in enumerate(self.forwarding_rules):
-                self.logger.debug(f"Checking rule {i+1}/{total_rules}: {rule['source']} -> {rule['target']}")
+            # Rules removed while the message was queued are skipped; edited ones are
+            # sent with their current target, filters and retry settings
+            current_rules = self.rules_snapshot.rules
+            rules = [current_rules[rule['id']] for rule in rules if rule['id'] in current_rules]
+            
+            age = time.time() - (sent_at if sent_at is not None else self._message_sent_at(message))
+            rendered = {}  # prefix -> content shared by every target that sends it
+            fingerprint = dispatch['fingerprint'] = self._content_fingerprint(message, album) if self.dedup_window > 0 else None
+            self.logger.debug(f"Forwarding message {message.id} via {len(rules)} matched rules")
+            
+            for i, rule in enumerate(rules):
+                # Already delivered by this rule (retry, or replay after a crash)
+                if self._already_delivered(source_id, message.id, rule, delivered):
+                    self.ledger_skips += 1
+                    self.logger.debug(f"Message {message.id} already delivered via rule {i+1}")
+                    continue
                 
-                # All rules in client are enabled by design
-                if await self._matches_rule(message, source_id, rule):
-                    self.logger.debug(f"Rule {i+1} matched! Forwarding message...")
-                    success = await self._forward_message(message, rule, worker_name)
-                    if success:
-                        forwarded_count += 1
-                        self.logger.info(f"Successfully forwarded via rule {i+1}: {rule['source']} -> {rule['target']}")
+                # Messages older than the rule's max_age are shed or marked as delayed
+                prefix = None
+                max_age = rule['filters'].get('max_age')
+                if max_age and age > float(max_age):
+                    if rule['filters'].get('late_action', 'skip') == 'mark':
+                        self.message_queue.record('late')
+                        prefix = f"⏰ Delayed {int(age)}s"
                     else:
-                        self.logger.warning(f"Failed to forward via rule {i+1}: {rule['source']} -> {rule['target']}")
-                else:
-                    self.logger.debug(f"Rule {i+1} did not match")
+                        self.message_queue.record('shed')
+                        self.logger.debug(f"Shed message {message.id} for rule {i+1}: {int(age)}s old, max_age {max_age}s")
+                        continue
+                
+                # Skip content this target already got (e.g. the same post cross-posted to several sources)
+                if fingerprint and self._claim_fingerprint(rule['target'], fingerprint):
+                    self.logger.debug(f"Skipping duplicate of message {message.id} for {rule['target']}")
+                    continue
+                
+                digest = self._digest_settings(rule)
+                flush = None
+                if digest:
+                    if not album and self._get_media_type(message) in ('text', 'web_preview') and message.text:
+                        self._add_to_digest(rule, digest, source_id, message, prefix)
+                        dispatch['forwarded'] += 1
+                        continue
+                    # Buffered text goes first so the target keeps the source order; the
+                    # send below starts once that flush is done, without holding the worker
+                    flush = self._spawn_digest_flush(rule['id'])
+                
+                if parked is not None and self.flood_gate.remaining(self._flood_key(rule['target'])) > 0:
+                    if fingerprint:
+                        self._release_fingerprint(rule['target'], fingerprint)
+                    parked.append(rule)
+                    continue
+                
+                # Native forwards can't carry the delayed marker; those are copied instead
+                if rule['filters'].get('forward_mode') == 'native' and not prefix:
+                    self.logger.debug(f"Rule {i+1} matched! Adding to forward batch...")
+                    send = self._after_flush(flush, lambda rule=rule: self._add_to_forward_batch(rule, source_id, message, album))
+                    dispatch['sends'].append((i, rule, send))
+                    dispatch['batched'] += 1
+                    continue
+                
+                self.logger.debug(f"Rule {i+1} matched! Scheduling send...")
+                if prefix not in rendered:
+                    rendered[prefix] = self._render_content(message, prefix, album)
+                content = rendered[prefix]
+                send = self._after_flush(flush, lambda rule=rule, prefix=prefix, content=content: self._schedule_forward(
+                    message, rule, worker_name, prefix, album, content, received_at
+                ))
+                dispatch['sends'].append((i, rule, send))
             
-            if forwarded_count > 0:
-                self.logger.info(f"{worker_name}: Forwarded message {message.id} to {forwarded_count} targets")
-            else:
-                self.logger.debug(f"{worker_name}: No rules matched for message {message.id}")
+            return dispatch
                     
         except Exception as e:
             self.logger.error(f"{worker_name}: Error processing message: {e}")
             self._handle_error()
+            dispatch['done'] = False
+            return dispatch
 
-    async def _process_message(self, event):
-        """Legacy method - redirects to internal processing"""
-        await self._process_message_internal(event, "legacy")
+    async def _finish_dispatch(self, dispatch):
+        """Wait for a message's scheduled sends; True when the message is done with"""
+        message = dispatch['message']
+        source_id = dispatch['source_id']
+        fingerprint = dispatch['fingerprint']
+        parked = dispatch['parked']
+        retries = dispatch['retries']
+        forwarded_count = dispatch['forwarded']
+        failed_count = 0
+        dead_letters = []
+        
+        for i, rule, send in dispatch['sends']:
+            error = None
+            try:
+                success = await send
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                success = False
+            
+            if success:
+                forwarded_count += 1
+                self._record_delivery(source_id, message.id, rule, success)
+                self.logger.info(f"Successfully forwarded via rule {i+1}: {rule['source']} -> {rule['target']}")
+            else:
+                if fingerprint:
+                    # Let a later copy or the replay through
+                    self._release_fingerprint(rule['target'], fingerprint)
+                if parked is not None and self.flood_gate.remaining(self._flood_key(rule['target'])) > 0:
+                    # Hit a flood wait: sent again once the target is unparked
+                    parked.append(rule)
+                    continue
+                if error is None:
+                    # No error to judge it by: the message stays in the journal
+                    failed_count += 1
+                    self.logger.warning(f"Failed to forward via rule {i+1}: {rule['source']} -> {rule['target']}")
+                    continue
+                
+                rule_id = self._ledger_rule_id(rule)
+                attempts = dispatch['attempts'].get(rule_id, 0)
+                budget = int(rule['filters'].get('max_retries', self.retry_max_attempts))
+                if retries is not None and is_transient(error) and attempts < budget:
+                    self.logger.warning(f"Send via rule {i+1} failed ({type(error).__name__}: {error}); retrying")
+                    retries.append(rule)
+                    continue
+                
+                self.logger.warning(
+                    f"Dead-lettering message {message.id} for rule {i+1}: {rule['source']} -> {rule['target']} "
+                    f"({type(error).__name__}: {error})"
+                )
+                album = dispatch['album']
+                dead_letters.append((
+                    source_id, message.id, [m.id for m in album] if album else [message.id], rule_id,
+                    str(rule['target']), type(error).__name__, str(error), attempts
+                ))
+        
+        if dead_letters:
+            try:
+                await asyncio.to_thread(self.db.add_dead_letters, dead_letters)
+                self.retry_stats['dead_lettered'] += len(dead_letters)
+            except Exception:
+                # Not recorded: keep the message in the journal instead
+                failed_count += len(dead_letters)
+        
+        if forwarded_count > 0:
+            self.logger.info(f"{dispatch['worker_name']}: Forwarded message {message.id} to {forwarded_count} targets")
+        else:
+            self.logger.debug(f"{dispatch['worker_name']}: No rules matched for message {message.id}")
+        
+        return dispatch['done'] and failed_count == 0
 
-    async def _matches_rule(self, message, source_id, rule):
-        """Check if message matches forwarding rule"""
+    def _pacing_delay(self):
+        """Human-like pause before a send - minimal in instant mode, normal otherwise"""
+        if self.instant_mode:
+            # Very minimal delay for instant forwarding (just enough to prevent spam detection)
+            return random.uniform(0.05, 0.15)  # 50-150ms
+        # Original human-like delay for stealth mode
+        return random.uniform(
+            self.delay_between_forwards * 0.5,
+            self.delay_between_forwards * 1.5
+        )
+
+    def _schedule_forward(self, message, rule, worker_name: str = "main", prefix=None, album=None,
+                          content=None, received_at=None):
+        """Schedule a send at its paced time; returns a future with _forward_message's result"""
+        key = self._flood_key(rule['target'])
+        # Rate limit budget (the target's and the account's) plus the pacing pause
+        delay = self.rate_limiter.reserve(key) + self._pacing_delay()
+        # Other targets of the same media wait for the first upload without taking a send slot
+        after, release = self._claim_media_upload(message, album)
+        
+        async def send():
+            if self.flood_gate.remaining(key) > 0:
+                # Parked since it was scheduled; the caller reschedules it
+                return False
+            sent = await self._forward_message(message, rule, worker_name, prefix, album, content)
+            if sent and received_at is not None:
+                self._record_target_latency(key, time.time() - received_at)
+            return sent
+        
+        future = self.send_scheduler.schedule(delay, key, send, after=after)
+        if release is not None:
+            future.add_done_callback(release)
+        return future
+
+    def _add_to_forward_batch(self, rule, source_id, message, album=None):
+        """Collect a message for a native forward; returns a future with its forwarded message"""
+        key = (source_id, self._flood_key(rule['target']))
+        ids = [m.id for m in album] if album else [message.id]
+        batch = self.forward_batches.get(key)
+        if batch is not None and batch['size'] + len(ids) > FORWARD_BATCH_MAX:
+            self._start_forward_batch(key)
+            batch = None
+        if batch is None:
+            batch = self.forward_batches[key] = {'rule': rule, 'source_id': source_id, 'entries': [], 'size': 0}
+            window = float(rule['filters'].get('batch_window', self.forward_batch_window))
+            batch['timer'] = self._spawn_batch_task(self._forward_batch_timer(key, batch, window))
+        
+        future = asyncio.get_running_loop().create_future()
+        batch['entries'].append({'rule': rule, 'message': message, 'album': album, 'ids': ids, 'future': future})
+        batch['size'] += len(ids)
+        if batch['size'] >= FORWARD_BATCH_MAX:
+            self._start_forward_batch(key)
+        return future
+
+    def _spawn_batch_task(self, coro):
+        task = asyncio.create_task(coro)
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+        return task
+
+    def _start_forward_batch(self, key):
+        batch = self.forward_batches.pop(key, None)
+        if batch:
+            # The window timer has nothing left to do
+            if batch['timer'] is not asyncio.current_task():
+                batch['timer'].cancel()
+            self._spawn_batch_task(self._send_forward_batch(batch))
+
+    async def _forward_batch_timer(self, key, batch, window):
+        """Send a batch when its window closes, unless it was sent already"""
+        await asyncio.sleep(window)
+        if self.forward_batches.get(key) is batch:
+            self._start_forward_batch(key)
+
+    async def _flush_all_forward_batches(self, timeout=None):
+        """Send every open batch and wait up to ``timeout`` seconds for all batch sends"""
+        for key in list(self.forward_batches):
+            self._start_forward_batch(key)
+        if self.batch_tasks:
+            await asyncio.wait(list(self.batch_tasks), timeout=timeout)
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    async def _send_forward_batch(self, batch):
+        """Forward a batch with one forward_messages call, copying the messages if that fails"""
+        rule = batch['rule']
+        entries = batch['entries']
+        ids = [message_id for entry in entries for message_id in entry['ids']]
+        key = self._flood_key(rule['target'])
+        flood_key = ACCOUNT
         try:
-            # Check if source matches
-            rule_source = rule['source']
+            try:
+                target_entity = await self._get_target_entity(rule['target'])
+                flood_key = key
+                sent = await self.send_scheduler.schedule(
+                    self.rate_limiter.reserve(key) + self._pacing_delay(), key,
+                    lambda: self.client.forward_messages(target_entity, ids, from_peer=batch['source_id'])
+                )
+            except FLOOD_ERRORS as e:
+                # The callers see the parked target and reschedule
+                self._park_for_flood(flood_key, e)
+                for entry in entries:
+                    self._resolve(entry['future'], False)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # E.g. the source restricts forwarding: copy the messages one by one
+                self.forward_stats['fallbacks'] += 1
+                self.logger.warning(f"Native forward to {rule['target']} failed ({e}); copying {len(entries)} messages instead")
+                for entry in entries:
+                    copy = self._schedule_forward(entry['message'], entry['rule'], "batch", album=entry['album'])
+                    try:
+                        self._resolve(entry['future'], await copy)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as copy_error:
+                        # The caller retries or dead-letters it
+                        if not entry['future'].done():
+                            entry['future'].set_exception(copy_error)
+                return
             
-            self.logger.info(f"Checking rule: source_id={source_id}, rule_source={rule_source}")
+            sent = sent if isinstance(sent, list) else [sent]
+            by_id = dict(zip(ids, sent))
+            for entry in entries:
+                forwarded = by_id.get(entry['ids'][0])
+                if forwarded is not None:
+                    entry['rule']['message_count'] += 1
+                    self.daily_forward_count += 1
+                self._resolve(entry['future'], forwarded or False)
+            self.last_forward_time = datetime.now()
+            self.forward_stats['batches'] += 1
+            self.forward_stats['messages'] += len(entries)
+            self.forward_stats['requests_saved'] += len(entries) - 1
+            self.logger.info(f"Forwarded {len(entries)} messages from {rule['source']} to {rule['target']} in one request")
             
-            # Handle username format (@username)
-            if rule_source.startswith('@'):
-                # Get entity by username
+            try:
+                self.db.log_activity(
+                    activity_type='message_forwarded',
+                    description=f"{len(entries)} messages forwarded natively from {rule['source']} to {rule['target']}",
+                    rule_id=rule.get('id'),
+                    details={'message_ids': ids, 'message_type': 'native_forward'}
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to log activity: {e}")
+        finally:
+            # Cancelled (stopping): the messages stay unacknowledged in the journal
+            for entry in entries:
+                if not entry['future'].done():
+                    entry['future'].cancel()
+
+    def _record_target_latency(self, key, latency):
+        samples = self.target_latencies.get(key)
+        if samples is None:
+            samples = self.target_latencies[key] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(latency)
+
+    def get_target_latency_stats(self, top=20):
+        """Receive-to-sent latency per target, slowest p95 first"""
+        stats = [
+            {
+                'target': key,
+                'samples': len(samples),
+                'p50_latency_ms': round(percentile(samples, 0.5) * 1000, 1),
+                'p95_latency_ms': round(percentile(samples, 0.95) * 1000, 1),
+                'max_latency_ms': round(max(samples) * 1000, 1)
+            }
+            for key, samples in self.target_latencies.items() if samples
+        ]
+        stats.sort(key=lambda s: s['p95_latency_ms'], reverse=True)
+        return stats[:top]
+
+    @staticmethod
+    def _render_content(message, prefix=None, album=None):
+        """Text, captions and special-type rendering of a message, prepared once for all its targets"""
+        text = message.text
+        if prefix:
+            # Marker line such as the delayed notice for late messages
+            text = f"{prefix}\n{text}" if text else prefix
+        
+        special = None
+        captions = None
+        if album:
+            captions = [(text or "") if m is message else (m.text or "") for m in album]
+        elif hasattr(message, 'poll') and message.poll:
+            # Poll message
+            special = f"📊 **Poll:** {message.poll.question}\n"
+            for i, answer in enumerate(message.poll.answers):
+                special += f"{i+1}. {answer.text}\n"
+        elif hasattr(message, 'contact') and message.contact:
+            # Contact message
+            special = f"📞 **Contact:**\n"
+            special += f"Name: {message.contact.first_name} {message.contact.last_name or ''}\n"
+            special += f"Phone: {message.contact.phone_number}"
+        elif hasattr(message, 'geo') and message.geo:
+            # Location message
+            special = f"📍 **Location:**\n"
+            special += f"Latitude: {message.geo.lat}\n"
+            special += f"Longitude: {message.geo.long}"
+        return {'text': text, 'special': special, 'captions': captions}
+
+    async def _process_message(self, event):
+        """Legacy method - redirects to internal processing"""
+        await self._process_message_internal(event.message, event.chat_id, "legacy")
+
+    async def _match_rules(self, message, source_id):
+        """Return the rules a message matches, highest priority first"""
+        # One consistent rule set for this whole message, even if rules change meanwhile
+        snapshot = self.rules_snapshot
+        
+        # Only rules whose source resolved to this chat are considered
+        candidate_rules = snapshot.routes.get(abs(source_id), ())
+        if not candidate_rules:
+            return []
+        
+        # Scan the text once for the keyword filters of every candidate rule
+        filter_context = self._build_filter_context(message)
+        keyword_matches = self.keyword_matcher.match(
+            filter_context.folded_text, [r['id'] for r in candidate_rules]
+        )
+        
+        matched = []
+        for rule in candidate_rules:
+            # All rules in client are enabled by design
+            if await self._matches_rule(message, source_id, rule, keyword_matches, filter_context, snapshot):
+                matched.append(rule)
+        matched.sort(key=lambda r: r.get('priority', 0), reverse=True)
+        return matched
+
+    @staticmethod
+    def _ledger_rule_id(rule):
+        """Stable rule id for the ledger: the database id, or the negated in-memory id"""
+        return rule['db_id'] if rule.get('db_id') is not None else -rule['id']
+
+    def _already_delivered(self, source_chat, message_id, rule, delivered=None):
+        rule_id = self._ledger_rule_id(rule)
+        if (source_chat, message_id, rule_id) in self.recent_deliveries:
+            return True
+        return bool(delivered) and rule_id in delivered
+
+    def _record_delivery(self, source_chat, message_id, rule, sent):
+        """Remember a delivery; written to the ledger with the next journal flush"""
+        if isinstance(sent, list):
+            sent = sent[0] if sent else None
+        target_message_id = getattr(sent, 'id', None)
+        rule_id = self._ledger_rule_id(rule)
+        self.recent_deliveries.set((source_chat, message_id, rule_id), target_message_id)
+        self.ledger_writes.append((source_chat, message_id, rule_id, target_message_id, int(time.time())))
+
+    async def _ledger_pruner(self):
+        """Delete ledger rows older than ledger_retention, hourly"""
+        while self.workers_running:
+            pruned = await asyncio.to_thread(self.db.prune_delivery_ledger, self.ledger_retention)
+            if pruned:
+                self.logger.info(f"Pruned {pruned} delivery ledger entries")
+            await asyncio.sleep(3600)
+
+    async def redrive_dead_letters(self, ids=None, limit=100, rate=None):
+        """Queue pending dead letters for their rule again, ``rate`` per minute, in the background"""
+        if not self.workers_running:
+            return {'success': False, 'message': 'Forwarding is not running'}
+        if self.supervisor.running('dead-letter-redrive'):
+            return {'success': False, 'message': 'A re-drive is already running'}
+        
+        letters = await asyncio.to_thread(self.db.get_dead_letters, 'pending', limit, ids)
+        rate = float(rate or self.redrive_rate)
+        if letters:
+            self.supervisor.spawn('dead-letter-redrive', lambda: self._redrive(letters, rate))
+            self.logger.info(f"Re-driving {len(letters)} dead letters at {rate:g} per minute")
+        return {'success': True, 'queued': len(letters), 'rate_per_minute': rate}
+
+    async def _redrive(self, letters, rate):
+        """Queue dead letters one by one, 60/rate seconds apart"""
+        while letters and self.workers_running:
+            letter = letters.pop(0)
+            rules = {self._ledger_rule_id(rule): rule for rule in self.rules_snapshot.rules.values()}
+            rule = rules.get(letter['rule_id'])
+            message_data = None
+            if rule is not None:
                 try:
-                    entity = await self.client.get_entity(rule_source)
-                    self.logger.info(f"Entity ID: {entity.id}, Source ID: {source_id}")
-                    
-                    # For channels/supergroups, Telegram uses different ID formats
-                    entity_chat_id = entity.id
-                    
-                    # Check if it's a channel or supergroup
-                    from telethon.tl.types import Channel
-                    if isinstance(entity, Channel):
-                        # For channels/supergroups, source_id is -100 + entity.id
-                        entity_chat_id = -1000000000000 - entity.id
-                        self.logger.info(f"Channel detected: converting {entity.id} to {entity_chat_id}")
-                    
-                    if entity_chat_id != source_id:
-                        self.logger.info(f"Source mismatch: {entity_chat_id} != {source_id}")
-                        return False
-                    else:
-                        self.logger.info(f"Source match found: {entity_chat_id} == {source_id}")
+                    messages = await self.client.get_messages(letter['source_chat'], ids=letter['message_ids'])
+                    messages = [m for m in messages if m is not None]
+                    if messages:
+                        message_data = await self._build_message_data(messages, letter['source_chat'], [rule])
                 except Exception as e:
-                    self.logger.error(f"Failed to get entity for {rule_source}: {e}")
-                    return False
+                    self.logger.warning(f"Could not fetch dead letter {letter['id']}: {e}")
+            
+            if message_data is None:
+                # Rule removed or message deleted: nothing left to send
+                status = 'discarded'
             else:
-                # Handle username without @ or direct chat ID
-                try:
-                    # Try to parse as integer first (direct chat ID)
-                    rule_id = int(rule_source)
-                    if str(abs(source_id)) != str(abs(rule_id)):
-                        self.logger.info(f"ID mismatch: {abs(source_id)} != {abs(rule_id)}")
-                        return False
-                except ValueError:
-                    # It's a username without @, add @ and try to get entity
-                    try:
-                        username_with_at = f"@{rule_source}" if not rule_source.startswith('@') else rule_source
-                        entity = await self.client.get_entity(username_with_at)
-                        self.logger.info(f"Entity ID: {entity.id}, Source ID: {source_id}")
-                        
-                        # For channels/supergroups, Telegram uses different ID formats
-                        entity_chat_id = entity.id
-                        
-                        # Check if it's a channel or supergroup
-                        from telethon.tl.types import Channel
-                        if isinstance(entity, Channel):
-                            # For channels/supergroups, source_id is -100 + entity.id
-                            entity_chat_id = -1000000000000 - entity.id
-                            self.logger.info(f"Channel detected: converting {entity.id} to {entity_chat_id}")
-                        
-                        if entity_chat_id != source_id:
-                            self.logger.info(f"Source mismatch: {entity_chat_id} != {source_id}")
-                            return False
-                        else:
-                            self.logger.info(f"Source match found: {entity_chat_id} == {source_id}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to get entity for {rule_source}: {e}")
-                        return False
-            
-            # Check keyword filters
-            filters = rule.get('filters', {})
-            message_text = message.text or ""
-            
-            # Include keywords filter
-            if filters.get('keywords'):
-                keywords = filters['keywords']
-                if not any(keyword.lower() in message_text.lower() for keyword in keywords):
-                    return False
+                # Age counts from the re-drive, so max_age doesn't shed it again; the
+                # ledger skips it if it was delivered in the meantime
+                message_data.update(sent_at=time.time(), deadline=None, replayed=True)
+                keys = self._journal_keys_of(message_data)
+                for key in keys:
+                    self._journal_append(key)
+                self.journal_keys.update(keys)
+                await self.message_queue.put(letter['source_chat'], message_data, message_data['priority'])
+                status = 'redriven'
             
-            # Exclude keywords filter
-            if filters.get('exclude_keywords'):
-                exclude_keywords = filters['exclude_keywords']
-                if any(keyword.lower() in message_text.lower() for keyword in exclude_keywords):
-                    return False
+            try:
+                await asyncio.to_thread(self.db.mark_dead_letters, [letter['id']], status)
+            except Exception:
+                pass  # Logged by the database; a later re-drive picks it up again
+            self.retry_stats[status] += 1
+            await asyncio.sleep(60.0 / rate)
+
+    @staticmethod
+    def _content_fingerprint(message, album=None):
+        """Hash of normalized text plus media ids, or None when there is nothing to compare"""
+        parts = album or [message]
+        text = ' '.join((message.text or '').casefold().split())
+        media_ids = []
+        for part in parts:
+            media = getattr(part, 'photo', None) or getattr(part, 'document', None)
+            if getattr(media, 'id', None) is not None:
+                media_ids.append(str(media.id))
+        if not text and not media_ids:
+            return None
+        content = text + '\x00' + ','.join(media_ids)
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+    def _claim_fingerprint(self, target, fingerprint):
+        """Return True if target already got this content; otherwise record it and return False"""
+        key = self._normalize_username(str(target))
+        cache = self.dedup_caches.get(key)
+        if cache is None:
+            cache = self.dedup_caches[key] = TTLCache(max_size=self.dedup_max_per_target, ttl=self.dedup_window)
+        if cache.get(fingerprint):
+            return True
+        # Recorded before sending so a concurrent copy on another worker is caught too
+        cache.set(fingerprint, True)
+        return False
+
+    def _release_fingerprint(self, target, fingerprint):
+        cache = self.dedup_caches.get(self._normalize_username(str(target)))
+        if cache is not None:
+            cache.pop(fingerprint)
+
+    def get_dedup_stats(self):
+        """Hit/miss counters of the duplicate suppression caches"""
+        hits = sum(cache.hits for cache in self.dedup_caches.values())
+        misses = sum(cache.misses for cache in self.dedup_caches.values())
+        return {
+            'window': self.dedup_window,
+            'targets': len(self.dedup_caches),
+            'entries': sum(len(cache) for cache in self.dedup_caches.values()),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0
+        }
+
+    async def _matches_rule(self, message, source_id, rule, keyword_matches=None, filter_context=None, snapshot=None):
+        """Check if message matches forwarding rule"""
+        try:
+            # Check if source matches (resolved once when the rule was indexed)
+            rule_chat_id = rule.get('source_chat_id')
+            if rule_chat_id is None or abs(rule_chat_id) != abs(source_id):
+                self.logger.debug(f"Source mismatch: {rule_chat_id} != {source_id}")
+                return False
+            
+            if filter_context is None:
+                filter_context = self._build_filter_context(message)
+            
+            # Check keyword filters (include hit and no exclude hit)
+            if keyword_matches is None:
+                keyword_matches = self.keyword_matcher.match(filter_context.folded_text, [rule['id']])
+            if rule['id'] not in keyword_matches:
+                return False
+            
+            # Check compiled regex/media/sender/length filters
+            predicate = (snapshot or self.rules_snapshot).predicates.get(rule['id'])
+            if predicate and not predicate(filter_context):
+                return False
             
             return True
             
@@ -744,229 +2267,255 @@ class SimpleTelegramClient:
             self.logger.error(f"Error matching rule: {e}")
             return False
 
-    async def _forward_message(self, message, rule, worker_name: str = "main"):
-        """Copy and send message as new message instead of forwarding"""
+    async def _forward_message(self, message, rule, worker_name: str = "main", prefix=None, album=None, content=None):
+        """Copy and send message as new message instead of forwarding.
+
+        Sends right away: callers pace it (see _schedule_forward). ``content``
+        is the message's _render_content, shared across targets. Returns the
+        sent message (or True) on success and False after a flood wait; other
+        errors are raised for the caller to retry or dead-letter.
+        """
+        if content is None:
+            content = self._render_content(message, prefix, album)
+        text = content['text']
+        sent = None
+        flood_key = ACCOUNT  # Until the target is resolved a flood wait applies to the account
+        media_key = None
         try:
-            # Rate limiting
-            async with self.throttler:
-                # Smart delay - minimal in instant mode, normal otherwise
-                if self.instant_mode:
-                    # Very minimal delay for instant forwarding (just enough to prevent spam detection)
-                    delay = random.uniform(0.05, 0.15)  # 50-150ms
-                else:
-                    # Original human-like delay for stealth mode
-                    delay = random.uniform(
-                        self.delay_between_forwards * 0.5,
-                        self.delay_between_forwards * 1.5
+            # Get target entity
+            target = rule['target']
+            target_entity = await self._get_target_entity(target)
+            flood_key = self._flood_key(target)
+            
+            # Copy message content instead of forwarding (bypasses protection)
+            success = False
+            
+            # Albums go out as one grouped send
+            if album:
+                sent = await self._send_album(target_entity, album, content['captions'])
+                success = True
+            
+            # Handle special message types first (poll, contact, location)
+            elif content['special'] is not None:
+                sent = await self.client.send_message(target_entity, content['special'])
+                success = True
+            
+            # Handle media messages - PROPER MEDIA FORWARDING
+            elif message.media:
+                media_key = self._media_key(message)
+                cached = self.media_cache.get(media_key) if media_key is not None else None
+                try:
+                    # First attempt: reuse an earlier send of this media, else forward it
+                    # directly (works for non-protected chats)
+                    sent = await self.client.send_file(
+                        target_entity,
+                        cached or message.media,
+                        caption=text or ""
                     )
-                await asyncio.sleep(delay)
-                
-                # Get target entity
-                target = rule['target']
-                if target.startswith('@'):
-                    target_entity = await self.client.get_entity(target)
-                else:
-                    # Handle username without @ or direct chat ID
-                    try:
-                        # Try to parse as integer first (direct chat ID)
-                        target_entity = int(target)
-                    except ValueError:
-                        # It's a username without @, add @ and get entity
-                        username_with_at = f"@{target}"
-                        target_entity = await self.client.get_entity(username_with_at)
-                
-                # Copy message content instead of forwarding (bypasses protection)
-                success = False
-                
-                # Handle special message types first
-                if hasattr(message, 'poll') and message.poll:
-                    # Poll message
-                    poll_text = f"📊 **Poll:** {message.poll.question}\n"
-                    for i, answer in enumerate(message.poll.answers):
-                        poll_text += f"{i+1}. {answer.text}\n"
-                    await self.client.send_message(target_entity, poll_text)
+                    self.logger.debug("Successfully forwarded media directly")
                     success = True
                     
-                elif hasattr(message, 'contact') and message.contact:
-                    # Contact message
-                    contact_text = f"📞 **Contact:**\n"
-                    contact_text += f"Name: {message.contact.first_name} {message.contact.last_name or ''}\n"
-                    contact_text += f"Phone: {message.contact.phone_number}"
-                    await self.client.send_message(target_entity, contact_text)
-                    success = True
+                except FLOOD_ERRORS:
+                    raise
+                except Exception as direct_error:
+                    if cached is not None:
+                        # Stale file reference: drop it, the upload below replaces it
+                        self.media_cache.pop(media_key)
+                    # If direct forwarding fails (protected chat), download and re-upload
+                    self.logger.debug(f"Direct forwarding failed, downloading media: {direct_error}")
                     
-                elif hasattr(message, 'geo') and message.geo:
-                    # Location message
-                    location_text = f"📍 **Location:**\n"
-                    location_text += f"Latitude: {message.geo.lat}\n"
-                    location_text += f"Longitude: {message.geo.long}"
-                    await self.client.send_message(target_entity, location_text)
-                    success = True
-                
-                # Handle media messages - PROPER MEDIA FORWARDING
-                elif message.media:
                     try:
-                        # First attempt: Direct media forwarding (works for non-protected chats)
-                        await self.client.send_file(
-                            target_entity,
-                            message.media,
-                            caption=message.text or ""
-                        )
-                        self.logger.debug("Successfully forwarded media directly")
-                        success = True
+                        # Download media to bytes in memory
+                        media_bytes = await self.client.download_media(message, file=bytes)
                         
-                    except Exception as direct_error:
-                        # If direct forwarding fails (protected chat), download and re-upload
-                        self.logger.debug(f"Direct forwarding failed, downloading media: {direct_error}")
-                        
-                        try:
-                            # Download media to bytes in memory
-                            media_bytes = await self.client.download_media(message, file=bytes)
-                            
-                            if media_bytes:
-                                # Determine media type and send with correct parameters
-                                if hasattr(message.media, 'photo'):
-                                    # Photo message - send with photo attributes
-                                    from telethon.tl.types import DocumentAttributeFilename
+                        if media_bytes:
+                            # Determine media type and send with correct parameters
+                            if hasattr(message.media, 'photo'):
+                                # Photo message - send with photo attributes
+                                from telethon.tl.types import DocumentAttributeFilename
+                                import io
+                                
+                                # Create a proper photo file object
+                                photo_file = io.BytesIO(media_bytes)
+                                photo_file.name = f"photo_{message.id}.jpg"
+                                
+                                sent = await self.client.send_file(
+                                    target_entity,
+                                    photo_file,
+                                    caption=text or "",
+                                    force_document=False,  # Ensure it's sent as photo
+                                    allow_cache=False
+                                )
+                                self.logger.debug("Successfully sent photo from protected chat")
+                                
+                            elif hasattr(message.media, 'document'):
+                                # Document/Video/Image - check MIME type and attributes
+                                doc = message.media.document
+                                mime_type = getattr(doc, 'mime_type', '').lower()
+                                
+                                # Get original filename from attributes
+                                filename = None
+                                if hasattr(doc, 'attributes'):
+                                    for attr in doc.attributes:
+                                        if hasattr(attr, 'file_name') and attr.file_name:
+                                            filename = attr.file_name
+                                            break
+                                
+                                if 'image' in mime_type:
+                                    # Image document - send as photo for preview
                                     import io
                                     
-                                    # Create a proper photo file object
-                                    photo_file = io.BytesIO(media_bytes)
-                                    photo_file.name = f"photo_{message.id}.jpg"
+                                    # Create proper image file object  
+                                    img_file = io.BytesIO(media_bytes)
+                                    img_file.name = filename or f"image_{message.id}.jpg"
                                     
-                                    await self.client.send_file(
+                                    sent = await self.client.send_file(
                                         target_entity,
-                                        photo_file,
-                                        caption=message.text or "",
-                                        force_document=False,  # Ensure it's sent as photo
+                                        img_file,
+                                        caption=text or "",
+                                        force_document=False,  # Send as photo/image
                                         allow_cache=False
                                     )
-                                    self.logger.debug("Successfully sent photo from protected chat")
-                                    
-                                elif hasattr(message.media, 'document'):
-                                    # Document/Video/Image - check MIME type and attributes
-                                    doc = message.media.document
-                                    mime_type = getattr(doc, 'mime_type', '').lower()
-                                    
-                                    # Get original filename from attributes
-                                    filename = None
-                                    if hasattr(doc, 'attributes'):
-                                        for attr in doc.attributes:
-                                            if hasattr(attr, 'file_name') and attr.file_name:
-                                                filename = attr.file_name
-                                                break
+                                    self.logger.debug("Successfully sent image as photo from protected chat")
                                     
-                                    if 'image' in mime_type:
-                                        # Image document - send as photo for preview
-                                        import io
-                                        
-                                        # Create proper image file object  
-                                        img_file = io.BytesIO(media_bytes)
-                                        img_file.name = filename or f"image_{message.id}.jpg"
-                                        
-                                        await self.client.send_file(
-                                            target_entity,
-                                            img_file,
-                                            caption=message.text or "",
-                                            force_document=False,  # Send as photo/image
-                                            allow_cache=False
-                                        )
-                                        self.logger.debug("Successfully sent image as photo from protected chat")
-                                        
-                                    elif 'video' in mime_type:
-                                        # Video - send as video with proper attributes
-                                        await self.client.send_file(
-                                            target_entity,
-                                            media_bytes,
-                                            caption=message.text or "",
-                                            force_document=False,  # Keep as video
-                                            file_name=filename,
-                                            supports_streaming=True
-                                        )
-                                        self.logger.debug("Successfully sent video from protected chat")
-                                        
-                                    else:
-                                        # Regular document - preserve as document with filename
-                                        await self.client.send_file(
-                                            target_entity,
-                                            media_bytes,
-                                            caption=message.text or "",
-                                            file_name=filename or f"document_{message.id}",
-                                            force_document=True  # Keep as document
-                                        )
-                                        self.logger.debug("Successfully sent document from protected chat")
+                                elif 'video' in mime_type:
+                                    # Video - send as video with proper attributes
+                                    sent = await self.client.send_file(
+                                        target_entity,
+                                        media_bytes,
+                                        caption=text or "",
+                                        force_document=False,  # Keep as video
+                                        file_name=filename,
+                                        supports_streaming=True
+                                    )
+                                    self.logger.debug("Successfully sent video from protected chat")
                                     
                                 else:
-                                    # Other media types - let Telegram auto-detect
-                                    await self.client.send_file(
+                                    # Regular document - preserve as document with filename
+                                    sent = await self.client.send_file(
                                         target_entity,
                                         media_bytes,
-                                        caption=message.text or "",
-                                        force_document=False  # Auto-detect format
+                                        caption=text or "",
+                                        file_name=filename or f"document_{message.id}",
+                                        force_document=True  # Keep as document
                                     )
-                                    self.logger.debug("Successfully sent media from protected chat")
+                                    self.logger.debug("Successfully sent document from protected chat")
                                 
-                                success = True
-                            else:
-                                raise Exception("Failed to download media")
-                                
-                        except Exception as download_error:
-                            self.logger.warning(f"Media download/upload failed: {download_error}")
-                            
-                            # Final fallback: Send text with media indicator
-                            if message.text:
-                                await self.client.send_message(
-                                    target_entity, 
-                                    f"📎 [Media couldn't be copied]\n{message.text}"
-                                )
                             else:
-                                await self.client.send_message(
-                                    target_entity, 
-                                    "📎 [Media from protected chat - couldn't be copied]"
+                                # Other media types - let Telegram auto-detect
+                                sent = await self.client.send_file(
+                                    target_entity,
+                                    media_bytes,
+                                    caption=text or "",
+                                    force_document=False  # Auto-detect format
                                 )
+                                self.logger.debug("Successfully sent media from protected chat")
+                            
                             success = True
-                
-                # Handle text-only messages (if not handled above)
-                if not success:
-                    if message.text:
-                        await self.client.send_message(target_entity, message.text)
-                        success = True
-                    else:
-                        # Empty message or unsupported content
-                        await self.client.send_message(target_entity, "[Empty or unsupported message]")
+                        else:
+                            raise Exception("Failed to download media")
+                            
+                    except FLOOD_ERRORS:
+                        raise
+                    except Exception as download_error:
+                        self.logger.warning(f"Media download/upload failed: {download_error}")
+                        
+                        # Final fallback: Send text with media indicator
+                        if text:
+                            sent = await self.client.send_message(
+                                target_entity, 
+                                f"📎 [Media couldn't be copied]\n{text}"
+                            )
+                        else:
+                            sent = await self.client.send_message(
+                                target_entity, 
+                                "📎 [Media from protected chat - couldn't be copied]"
+                            )
                         success = True
-                
-                # Update counters
-                self.daily_forward_count += 1
-                rule['message_count'] += 1
-                self.last_forward_time = datetime.now()
-                
-                # Update database counters and log activity
-                self.logger.info(f"Copied message from {rule['source']} to {rule['target']}")
-                
-                # Log the forwarding activity
-                try:
-                    from database import DatabaseManager
-                    db = DatabaseManager()
-                    db.log_activity(
-                        activity_type='message_forwarded',
-                        description=f"Message forwarded from {rule['source']} to {rule['target']}",
-                        rule_id=rule.get('id'),
-                        details={
-                            'message_id': message.id,
-                            'message_type': 'media' if message.media else 'text',
-                            'has_text': bool(message.text)
-                        }
-                    )
-                except Exception as e:
-                    self.logger.error(f"Failed to log activity: {e}")
-                
-                return True
-                
+            
+            # Handle text-only messages (if not handled above)
+            if not success:
+                if text:
+                    sent = await self.client.send_message(target_entity, text)
+                    success = True
+                else:
+                    # Empty message or unsupported content
+                    sent = await self.client.send_message(target_entity, "[Empty or unsupported message]")
+                    success = True
+            
+            if media_key is not None:
+                self._remember_media(media_key, sent)
+            
+            # Update counters
+            self.daily_forward_count += 1
+            rule['message_count'] += 1
+            self.last_forward_time = datetime.now()
+            
+            # Update database counters and log activity
+            self.logger.info(f"Copied message from {rule['source']} to {rule['target']}")
+            
+            # Log the forwarding activity
+            try:
+                self.db.log_activity(
+                    activity_type='message_forwarded',
+                    description=f"Message forwarded from {rule['source']} to {rule['target']}",
+                    rule_id=rule.get('id'),
+                    details={
+                        'message_id': message.id,
+                        'message_type': 'album' if album else 'media' if message.media else 'text',
+                        'has_text': bool(message.text)
+                    }
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to log activity: {e}")
+            
+            # The sent message (truthy) lets callers record the delivery
+            return sent or True
+            
+        except FLOOD_ERRORS as e:
+            # Not an error of ours: no cooldown, the caller reschedules the send
+            self._park_for_flood(flood_key, e)
+            return False
         except Exception as e:
             self.logger.error(f"Failed to copy message: {e}")
-            self._handle_error()
-            return False
+            if isinstance(e, RESTRICTION_ERRORS):
+                self._handle_error()
+            raise
+
+    @staticmethod
+    def _media_key(message):
+        """Cache key of a message's photo or document, or None for other media"""
+        media = getattr(message, 'photo', None) or getattr(message, 'document', None)
+        media_id = getattr(media, 'id', None)
+        return (type(media).__name__, media_id) if media_id is not None else None
+
+    def _claim_media_upload(self, message, album=None):
+        """Order a media send behind another send of the same media, so it can reuse that upload.
+
+        Returns (after, release): ``after`` is the future of the upload in
+        progress to wait for; ``release`` is set for the first send of media
+        not cached yet, a callback to run once that send is done.
+        """
+        media_key = None if album else self._media_key(message)
+        if media_key is None or media_key in self.media_cache:
+            return None, None
+        pending = self.media_uploads.get(media_key)
+        if pending is not None:
+            return pending, None
+        upload = self.media_uploads[media_key] = asyncio.get_running_loop().create_future()
+        
+        def done(_):
+            # Let the sends waiting on this upload go, with or without a cached copy
+            if self.media_uploads.get(media_key) is upload:
+                del self.media_uploads[media_key]
+            upload.set_result(None)
+        return None, done
+
+    def _remember_media(self, media_key, sent):
+        """Cache the media of a successful send for the next send of the same source media"""
+        media = getattr(sent, 'media', None)
+        if media is not None and (getattr(sent, 'photo', None) or getattr(sent, 'document', None)):
+            self.media_cache.set(media_key, media)
 
     async def get_stats(self):
         """Get forwarding statistics"""
@@ -978,8 +2527,35 @@ class SimpleTelegramClient:
                 'daily_forwards': self.daily_forward_count,
                 'max_daily_forwards': self.max_daily_forwards,
                 'total_rules': len(self.forwarding_rules),
+                'rules_version': self.rules_snapshot.version,
+                'queue': self.message_queue.get_stats(),
+                'tasks': self.supervisor.get_stats(),
+                'catch_up': dict(self.catchup_stats, active=len(self.catching_up)),
+                'dedup': self.get_dedup_stats(),
+                'rate_limits': self.rate_limiter.get_stats(),
+                'scheduler': dict(self.send_scheduler.get_stats(), dispatching=len(self.dispatch_tasks)),
+                'target_latency': self.get_target_latency_stats(),
+                'forward_batches': dict(self.forward_stats, open=len(self.forward_batches)),
+                'flood': dict(self.flood_gate.get_stats(), waiting_sends=len(self.flood_waiting) + len(self.flood_tasks)),
+                'retries': dict(self.retry_stats, redriving=bool(self.supervisor.running('dead-letter-redrive'))),
+                'ledger': {
+                    'skipped_redeliveries': self.ledger_skips,
+                    'unflushed': len(self.ledger_writes),
+                    'recent': len(self.recent_deliveries)
+                },
+                'digests': dict(self.digest_stats, open=len(self.digests), buffered=len(self.digest_holds)),
+                'journal': {
+                    'spilled_pending': self.spilled_pending,
+                    'spilled_chats': len(self.spilled_chats),
+                    'unflushed_writes': len(self.journal_writes),
+                    'unflushed_acks': len(self.journal_acks)
+                },
                 'consecutive_errors': self.consecutive_errors,
-                'phone': self.phone
+                'phone': self.phone,
+                'entity_cache': self.entity_cache.get_stats(),
+                'media_cache': dict(self.media_cache.get_stats(), uploading=len(self.media_uploads)),
+                'keyword_matcher': self.keyword_matcher.get_stats(),
+                'filters': self.get_filter_stats()[:20]
             }
         }
 
@@ -1008,6 +2584,275 @@ class SimpleTelegramClient:
             self.logger.error(f"Error getting user info: {e}")
             return {'success': False, 'message': str(e)}
 
+    @staticmethod
+    def _digest_settings(rule):
+        """Digest options of a rule, or None when it sends messages one by one"""
+        digest = rule['filters'].get('digest')
+        if not digest:
+            return None
+        if digest is True:
+            digest = {}
+        return {
+            'window': float(digest.get('window', 60)),
+            'max_chars': int(digest.get('max_chars', MAX_MESSAGE_LENGTH)),
+            'max_messages': int(digest.get('max_messages', 50))
+        }
+
+    def _add_to_digest(self, rule, digest, source_id, message, prefix=None):
+        """Buffer a text message for a digest rule, sending the digest in the background once it is full"""
+        buffer = self.digests.get(rule['id'])
+        if buffer is None:
+            buffer = self.digests[rule['id']] = {'rule': rule, 'parts': [], 'chars': 0, 'keys': [], 'attempts': 0}
+            task = asyncio.create_task(self._digest_timer(rule['id'], buffer, digest['window']))
+            self.digest_tasks.add(task)
+            task.add_done_callback(self.digest_tasks.discard)
+        
+        text = f"{prefix}\n{message.text}" if prefix else message.text
+        buffer['parts'].append(text)
+        buffer['chars'] += len(text) + 2
+        key = (source_id, message.id)
+        buffer['keys'].append(key)
+        self.digest_holds[key] += 1
+        
+        if buffer['chars'] >= digest['max_chars'] or len(buffer['parts']) >= digest['max_messages']:
+            self._spawn_digest_flush(rule['id'])
+
+    async def _digest_timer(self, rule_id, buffer, window):
+        """Send a digest when its window closes, unless it was sent already"""
+        await asyncio.sleep(window)
+        if self.digests.get(rule_id) is buffer:
+            self._spawn_digest_flush(rule_id)
+
+    async def _flush_all_digests(self, timeout=None):
+        """Send every open digest and wait up to ``timeout`` seconds for all digest sends.
+
+        Sends still running after that are cancelled; their messages stay
+        unacknowledged in the ingest journal.
+        """
+        for rule_id in list(self.digests):
+            self._spawn_digest_flush(rule_id)
+        if not self.digest_flushes:
+            return
+        _, pending = await asyncio.wait(list(self.digest_flushes.values()), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self.logger.warning(f"Cancelled {len(pending)} digest sends still running at stop")
+            await asyncio.wait(pending)
+
+    def _spawn_digest_flush(self, rule_id):
+        """Send a rule's open digest in a task, after the rule's previous digest.
+
+        Returns the task of the rule's latest digest send (None when there is
+        none); sends that must follow the buffered text wait for it.
+        """
+        previous = self.digest_flushes.get(rule_id)
+        buffer = self.digests.pop(rule_id, None)
+        if buffer is None:
+            return previous
+        
+        async def flush():
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await self._send_digest_buffer(buffer)
+        
+        task = asyncio.create_task(flush())
+        self.digest_tasks.add(task)
+        task.add_done_callback(self.digest_tasks.discard)
+        self.digest_flushes[rule_id] = task
+        
+        def forget(done):
+            if self.digest_flushes.get(rule_id) is done:
+                del self.digest_flushes[rule_id]
+        task.add_done_callback(forget)
+        return task
+
+    @staticmethod
+    def _after_flush(flush, start):
+        """Start a send now, or once a digest flush is done; returns an awaitable with its result"""
+        if flush is None or flush.done():
+            return start()
+        
+        async def chained():
+            await asyncio.wait([flush])
+            if flush.cancelled():
+                # Stopping: the message stays in the journal
+                raise asyncio.CancelledError
+            return await start()
+        
+        return asyncio.create_task(chained())
+
+    async def _send_digest_buffer(self, buffer):
+        rule = buffer['rule']
+        error = None
+        try:
+            sent = await self._send_digest(rule, buffer['parts'])
+        except Exception as e:
+            error = e
+            sent = False
+        
+        budget = int(rule['filters'].get('max_retries', self.retry_max_attempts))
+        retryable = error is not None and is_transient(error) and buffer['attempts'] < budget
+        if not sent and self.workers_running:
+            delay = self.flood_gate.remaining(self._flood_key(rule['target']))
+            if delay > 0:
+                # Keep the holds and send the rest once the flood wait is over
+                self.flood_gate.record('rescheduled')
+            elif retryable:
+                buffer['attempts'] += 1
+                self.retry_stats['retried'] += 1
+                delay = backoff_delay(buffer['attempts'], self.retry_base_delay, self.retry_max_delay)
+                self.logger.warning(f"Digest to {rule['target']} failed ({type(error).__name__}: {error}); retrying in {delay:.1f}s")
+            if delay > 0 or retryable:
+                task = asyncio.create_task(self._retry_digest(buffer, delay))
+                self.flood_tasks.add(task)
+                task.add_done_callback(self.flood_tasks.discard)
+                return False
+        
+        # Failed for good: its messages go to the dead letters instead of staying in the journal
+        dead_lettered = False
+        if error is not None and not retryable:
+            rule_id = self._ledger_rule_id(rule)
+            self.logger.warning(
+                f"Dead-lettering {len(buffer['keys'])} digest messages for {rule['source']} -> {rule['target']} "
+                f"({type(error).__name__}: {error})"
+            )
+            try:
+                await asyncio.to_thread(self.db.add_dead_letters, [
+                    (source_chat, message_id, [message_id], rule_id, str(rule['target']),
+                     type(error).__name__, str(error), buffer['attempts'])
+                    for source_chat, message_id in buffer['keys']
+                ])
+                self.retry_stats['dead_lettered'] += len(buffer['keys'])
+                dead_lettered = True
+            except Exception:
+                pass  # Logged by the database; the messages stay in the journal
+        
+        for key in buffer['keys']:
+            if sent:
+                self._record_delivery(key[0], key[1], buffer['rule'], sent)
+            self.digest_holds[key] -= 1
+            if self.digest_holds[key] > 0:
+                continue
+            del self.digest_holds[key]
+            if not sent and not dead_lettered:
+                self.digest_failed.add(key)
+            if key in self.deferred_acks:
+                self.deferred_acks.discard(key)
+                self._ack_processed(key)
+        return sent
+
+    async def _retry_digest(self, buffer, delay):
+        await asyncio.sleep(delay)
+        await self._send_digest_buffer(buffer)
+
+    @staticmethod
+    def _pack_digest(parts, limit=MAX_MESSAGE_LENGTH):
+        """Join digest parts into as few messages as fit Telegram's length limit"""
+        chunks = []
+        current = ''
+        for part in parts:
+            while len(part) > limit:
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.append(part[:limit])
+                part = part[limit:]
+            candidate = f"{current}\n\n{part}" if current else part
+            if len(candidate) > limit:
+                chunks.append(current)
+                current = part
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _send_digest(self, rule, parts):
+        """Send buffered text to a rule's target as combined messages.
+
+        Returns the last message sent, or False after a flood wait; other
+        errors are raised. After a failure, ``parts`` is left holding only
+        the chunks not sent yet.
+        """
+        chunks = self._pack_digest(parts)
+        flood_key = ACCOUNT
+        sent_chunks = 0
+        try:
+            target_entity = await self._get_target_entity(rule['target'])
+            flood_key = self._flood_key(rule['target'])
+            for chunk in chunks:
+                # Through the scheduler, so the digest keeps its place among the target's sends
+                sent = await self.send_scheduler.schedule(
+                    self.rate_limiter.reserve(flood_key), flood_key,
+                    lambda chunk=chunk: self.client.send_message(target_entity, chunk)
+                )
+                sent_chunks += 1
+                self.daily_forward_count += 1
+            
+            rule['message_count'] += len(parts)
+            self.last_forward_time = datetime.now()
+            self.digest_stats['digests'] += 1
+            self.digest_stats['chunks'] += len(chunks)
+            self.digest_stats['messages'] += len(parts)
+            self.logger.info(f"Sent digest of {len(parts)} messages in {len(chunks)} parts from {rule['source']} to {rule['target']}")
+            
+            try:
+                self.db.log_activity(
+                    activity_type='digest_forwarded',
+                    description=f"Digest of {len(parts)} messages forwarded from {rule['source']} to {rule['target']}",
+                    rule_id=rule.get('id'),
+                    details={'messages': len(parts), 'chunks': len(chunks)}
+                )
+            except Exception as e:
+                self.logger.error(f"Failed to log activity: {e}")
+            return sent or True
+            
+        except FLOOD_ERRORS as e:
+            self._park_for_flood(flood_key, e)
+            parts[:] = chunks[sent_chunks:]
+            return False
+        except Exception as e:
+            # Raised for _send_digest_buffer to retry or dead-letter; only unsent chunks are kept
+            self.digest_stats['failures'] += 1
+            self.logger.error(f"Failed to send digest to {rule['target']}: {e}")
+            parts[:] = chunks[sent_chunks:]
+            if isinstance(e, RESTRICTION_ERRORS):
+                self._handle_error()
+            raise
+
+    async def _send_album(self, target_entity, album, captions):
+        """Send album parts as one multi-file message, keeping each part's caption"""
+        keys = [self._media_key(m) for m in album]
+        cached = [self.media_cache.get(key) if key else None for key in keys]
+        try:
+            files = [media or m.media for media, m in zip(cached, album)]
+            sent = await self.client.send_file(target_entity, files, caption=captions)
+            self.logger.debug(f"Successfully forwarded album of {len(album)} items directly")
+        except FLOOD_ERRORS:
+            raise
+        except Exception as direct_error:
+            for key, media in zip(keys, cached):
+                if media is not None:
+                    self.media_cache.pop(key)
+            # Protected chat: download every part and upload them together
+            self.logger.debug(f"Direct album forwarding failed, downloading media: {direct_error}")
+            files = []
+            for m in album:
+                media_bytes = await self.client.download_media(m, file=bytes)
+                if not media_bytes:
+                    raise Exception(f"Failed to download album item {m.id}")
+                media_file = io.BytesIO(media_bytes)
+                media_file.name = self._get_media_filename(m)
+                files.append(media_file)
+            sent = await self.client.send_file(target_entity, files, caption=captions)
+            self.logger.debug(f"Successfully sent album of {len(album)} items from protected chat")
+        if isinstance(sent, list) and len(sent) == len(album):
+            for key, part in zip(keys, sent):
+                if key is not None:
+                    self._remember_media(key, part)
+        return sent
+
     def _get_media_filename(self, message):
         """Get appropriate filename for media based on message type"""
         try:
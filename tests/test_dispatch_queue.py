@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from dispatch_queue import ShardedQueue, resolve_overflow_policy
+
+
+def test_rule_overflow_policy_overrides_default():
+    assert resolve_overflow_policy(['drop_newest'], 'spill') == 'drop_newest'
+
+
+def test_default_overflow_policy_without_rule_policies():
+    assert resolve_overflow_policy([None, 'bogus'], 'block') == 'block'
+
+
+def test_most_conservative_rule_overflow_policy_wins():
+    assert resolve_overflow_policy(['drop_newest', 'coalesce', None], 'spill') == 'coalesce'
+
+
+def _drain(queue):
+    async def drain():
+        return [await queue.get(0) for _ in range(queue.qsize())]
+    return asyncio.run(drain())
+
+
+def test_deadline_never_reorders_messages_of_one_chat():
+    queue = ShardedQueue(1)
+    now = time.time()
+    queue.put_nowait('a', 'a1', deadline=now + 60)
+    queue.put_nowait('a', 'a2', deadline=now + 1)
+    assert _drain(queue) == ['a1', 'a2']
+
+
+def test_earliest_deadline_picks_the_chat():
+    queue = ShardedQueue(1)
+    now = time.time()
+    queue.put_nowait('a', 'a1', deadline=now + 60)
+    queue.put_nowait('b', 'b1', deadline=now + 30)
+    queue.put_nowait('a', 'a2', deadline=now + 1)
+    # a2's deadline moves chat a ahead of b, without passing a1
+    assert _drain(queue) == ['a1', 'a2', 'b1']
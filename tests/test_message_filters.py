@@ -0,0 +1,21 @@
+import pytest
+
+import message_filters
+from message_filters import FilterError, RegexPredicate
+
+stdlib_only = pytest.mark.skipif(
+    message_filters.regex_engine is not None, reason="patterns are only screened without the regex package"
+)
+
+
+@stdlib_only
+@pytest.mark.parametrize('pattern', [r'(a+)+$', r'(a|aa)+$', r'(\w|\d\d)+$', r'(?i)(a|Aa)+$'])
+def test_backtracking_patterns_are_rejected(pattern):
+    with pytest.raises(FilterError):
+        RegexPredicate(pattern)
+
+
+@stdlib_only
+@pytest.mark.parametrize('pattern', [r'^(\d{3})+$', r'(?:foo|far)+$', r'(ab|ac)+', r'(\w|\d)+$', r'urgent|alert'])
+def test_safe_patterns_are_accepted(pattern):
+    RegexPredicate(pattern)